@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark of the cost of a push in the Join with the backends of pynodered.state, in one process and in several processes sharing
+the SQLite database (the messages of each group are pushed by different processes).
+
+    $ python benchmarks/bench_join.py --groups 10000 --processes 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import tempfile
+import time
+
+from pynodered.core import Join
+from pynodered.state import MemoryState, SQLiteState
+
+
+def timeit(label, f, n=1):
+    t0 = time.perf_counter()
+    f()
+    dt = time.perf_counter() - t0
+    print("%-55s %8.3f s  %8.3f us/push" % (label, dt, dt / n * 1e6))
+
+
+def push_groups(join, groups, topics, start=0, step=1):
+    # push the msgs of the topics of every step-th group, from start
+    for topic in topics:
+        for i in range(start, groups, step):
+            join.push({'_msgid': "m%i" % i, 'topic': topic, 'payload': i})
+
+
+def worker(path, groups, topics, start, step):
+    join = Join(topics, state=SQLiteState(path))
+    join.name = "bench"
+    push_groups(join, groups, topics[start::step], 0, 1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--groups', type=int, default=10000)
+    parser.add_argument('--topics', type=int, default=2)
+    parser.add_argument('--processes', type=int, default=2)
+    args = parser.parse_args()
+    n = args.groups * args.topics
+    topics = ["t%i" % i for i in range(args.topics)]
+
+    join = Join(topics, state=MemoryState())
+    timeit("memory: %i groups of %i msgs" % (args.groups, args.topics), lambda: push_groups(join, args.groups, topics), n)
+    assert join.pending() == 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "state.db")
+        join = Join(topics, state=SQLiteState(path))
+        join.name = "bench"
+        timeit("sqlite: %i groups of %i msgs" % (args.groups, args.topics), lambda: push_groups(join, args.groups, topics), n)
+        assert join.pending() == 0
+
+        join.max_pending = join.groups.max_pending = args.groups // 10
+        timeit("sqlite: %i incomplete groups, max_pending %i" % (args.groups, join.max_pending),
+               lambda: push_groups(join, args.groups, topics[:1]), args.groups)
+        for i in range(args.groups):
+            join.clean({'_msgid': "m%i" % i})
+
+        # each process pushes the msgs of some of the topics of all the groups
+        processes = min(args.processes, args.topics)
+
+        def concurrent():
+            workers = [multiprocessing.Process(target=worker, args=(path, args.groups, topics, i, processes)) for i in range(processes)]
+            for w in workers:
+                w.start()
+            for w in workers:
+                w.join()
+        timeit("sqlite: %i processes pushing the topics of each group" % processes, concurrent, n)
+        assert join.pending() == 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Benchmark of pynodered.ttldict.TTLDict with a large number of keys.
+
+    $ python benchmarks/bench_ttldict.py --keys 1000000
+"""
+
+import argparse
+import time
+
+from pynodered.ttldict import TTLDict
+
+
+def timeit(label, f, n=1):
+    t0 = time.perf_counter()
+    f()
+    dt = time.perf_counter() - t0
+    print("%-45s %8.3f s  %8.3f us/op" % (label, dt, dt / n * 1e6))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, default=1000000)
+    args = parser.parse_args()
+    n = args.keys
+
+    d = TTLDict(3600)
+
+    def insert():
+        for i in range(n):
+            d[i] = i
+    timeit("insert %i keys" % n, insert, n)
+
+    def get():
+        for i in range(n):
+            d[i]
+    timeit("get %i keys" % n, get, n)
+
+    def length():
+        for i in range(1000):
+            len(d)
+    timeit("1000 len() without expired keys", length, 1000)
+
+    def update():
+        for i in range(n):
+            d[i] = i
+    timeit("set again %i keys" % n, update, n)
+
+    # expire half of the keys
+    now = time.time()
+    for i in range(0, n, 2):
+        d.expire_at(i, now)
+    timeit("len() purging %i expired keys" % (n // 2), lambda: len(d), n // 2)
+    assert len(d) == n - n // 2
+
+    timeit("items() of %i keys" % len(d), d.items)
+
+    # steady state: a reaper thread removes the expired keys in the background
+    d = TTLDict(0.5, reaper_interval=0.1)
+
+    def churn():
+        for i in range(n):
+            d[i] = i
+    timeit("insert %i keys with a ttl of 0.5 s and a reaper" % n, churn, n)
+    time.sleep(1)
+    print("keys left after 1 s: %i" % len(d._data))
+    d.stop_reaper()
+
+
+if __name__ == '__main__':
+    main()
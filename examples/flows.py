@@ -0,0 +1,27 @@
+
+from pynodered import node_red
+
+
+@node_red(category="pyfuncs", join=["x", "y"])
+def sum_topics(node, msg):
+
+    payloads = node.join(msg)  # waits for the messages with the topics x and y
+    msg['payload'] = sum(payloads)
+    return msg
+
+
+@node_red(category="pyfuncs", outputs=2, output_labels=["even", "odd"])
+def route(node, msg):
+
+    msg['selected_output'] = msg['payload'] % 2
+    return msg
+
+
+@node_red(category="pyfuncs")
+def reverse_buffer(node, msg):
+
+    payload = msg['payload']
+    if isinstance(payload, dict) and payload.get('type') == "Buffer":  # a Buffer sent with the json codec
+        payload = bytes(payload['data'])
+    msg['payload'] = payload[::-1]
+    return msg
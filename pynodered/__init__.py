@@ -7,4 +7,4 @@ __email__ = 'ghipicard@gmail.com'
 __version__ = '0.1.0'
 
 
-from pynodered.core import node_red, NodeProperty
\ No newline at end of file
+from pynodered.core import node_red, node_red_pipeline, NodeProperty, get_deadline, DeadlineExceeded
\ No newline at end of file
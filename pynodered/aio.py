@@ -0,0 +1,26 @@
+"""Shared asyncio event loop running the coroutine functions of the nodes (declared with async def). The loop runs in a background
+thread so that many I/O-bound calls can wait concurrently without holding a server thread each.
+"""
+
+import asyncio
+import threading
+
+_loop = None
+_lock = threading.Lock()
+
+
+def get_loop():
+    """return the shared event loop, started on the first call"""
+
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="pynodered event loop", daemon=True).start()
+    return _loop
+
+
+def submit(coro):
+    """schedule the coroutine in the shared event loop and return a concurrent.futures.Future"""
+
+    return asyncio.run_coroutine_threadsafe(coro, get_loop())
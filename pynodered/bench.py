@@ -0,0 +1,256 @@
+"""Load test of the JSON-RPC path between Node-RED and the pynodered server. The benchmark starts a server on the nodes
+of pynodered.bench_nodes (or uses a running server with --url) and sends the calls that the Node-RED nodes would send,
+from several clients, at a given rate or as fast as possible. The results are printed as JSON, one entry per scenario:
+
+    $ pynodered-bench --duration 5 --concurrency 8 --codec msgpack --batch 10
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from pathlib import Path
+
+from pynodered.codec import codecs_by_name
+
+
+# the scenarios are named after the nodes of pynodered.bench_nodes. The functions return the msg number i of a client
+def _lower_case(node_id, i, size):
+    return {'payload': "A" * size}
+
+
+def _repeat(node_id, i, size):
+    return {'payload': "a" * max(size // 2, 1)}
+
+
+def _sum_topics(node_id, i, size):
+    # two messages with the same _msgid and the topics x and y complete a group of the join
+    return {'_msgid': "%s-%i" % (node_id, i // 2), 'topic': "xy"[i % 2], 'payload': i}
+
+
+def _route(node_id, i, size):
+    return {'payload': i}
+
+
+def _reverse_buffer(node_id, i, size):
+    data = bytes(range(256)) * (size // 256) + bytes(range(size % 256))
+    return {'payload': data}  # sent as a Buffer by the json codec and as bytes by msgpack
+
+
+scenarios = {
+    "lower_case": (_lower_case, {}),
+    "repeat": (_repeat, {"number": "2"}),
+    "sum_topics": (_sum_topics, {}),
+    "route": (_route, {}),
+    "reverse_buffer": (_reverse_buffer, {}),
+}
+
+
+def percentile(values, q):
+    """return the q-th percentile of the sorted values"""
+    if not values:
+        return None
+    return values[min(int(round(q / 100 * (len(values) - 1))), len(values) - 1)]
+
+
+class Client(threading.Thread):
+    """send the calls of one Node-RED node, in batches of the given size, and record the latency of each request"""
+
+    def __init__(self, url, scenario, client_id, args, start, stop):
+        super().__init__(daemon=True)
+        self.url = urllib.parse.urlparse(url)
+        self.method = scenario
+        self.make_msg, properties = scenarios[scenario]
+        self.codec = codecs_by_name[args.codec]
+        self.node_id = "bench-%s-%i" % (scenario, client_id)
+        self.config = dict(properties, id=self.node_id)
+        self.args = args
+        self.start_time = start
+        self.stop_time = stop
+        self.interval = args.concurrency * args.batch / args.rate if args.rate else 0
+        self.latencies = []
+        self.messages = 0
+        self.errors = 0
+        self.ids = itertools.count()
+        self.registered = False
+        self.connection = None
+
+    def request(self, calls):
+        body = self.codec.dumps(calls if len(calls) > 1 else calls[0])
+        headers = {"content-type": self.codec.content_type, "accept": self.codec.content_type}
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.url.hostname, self.url.port or 80, timeout=60)
+            try:
+                self.connection.request("POST", self.url.path or "/", body, headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, ConnectionError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    raise
+        if self.args.transport == "http":
+            self.connection.close()  # a new connection for each request
+            self.connection = None
+        responses = self.codec.loads(data)
+        return responses if isinstance(responses, list) else [responses]
+
+    def run(self):
+        i = 0
+        scheduled = self.start_time
+        while True:
+            if self.interval:
+                # open loop: the latency is measured from the scheduled time so that a slow server is not hidden
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            t0 = scheduled if self.interval else time.perf_counter()
+            if t0 >= self.stop_time:
+                break
+            calls = []
+            for k in range(self.args.batch):
+                params = {"msg": self.make_msg(self.node_id, i, self.args.size),
+                          "node_id": self.node_id}
+                if not self.registered:
+                    params["config"] = self.config
+                    self.registered = True
+                calls.append({"jsonrpc": "2.0", "method": self.method, "params": params, "id": str(next(self.ids))})
+                i += 1
+            try:
+                responses = self.request(calls)
+            except Exception:
+                self.errors += len(calls)
+            else:
+                self.errors += sum(1 for r in responses if "error" in r)
+                self.messages += len(calls)
+            self.latencies.append(time.perf_counter() - t0)
+            scheduled += self.interval
+        if self.connection is not None:
+            self.connection.close()
+
+
+def run_scenario(url, scenario, args):
+    start = time.perf_counter() + 0.1
+    stop = start + args.duration
+    clients = [Client(url, scenario, i, args, start, stop) for i in range(args.concurrency)]
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    elapsed = max(time.perf_counter(), stop) - start
+
+    latencies = sorted(itertools.chain.from_iterable(c.latencies for c in clients))
+    messages = sum(c.messages for c in clients)
+
+    def ms(v):
+        return None if v is None else round(v * 1000, 3)
+
+    return {
+        "scenario": scenario,
+        "codec": args.codec,
+        "transport": args.transport,
+        "server": args.server,
+        "threads": args.threads,
+        "concurrency": args.concurrency,
+        "batch": args.batch,
+        "size": args.size,
+        "rate": args.rate,
+        "duration": round(elapsed, 3),
+        "requests": len(latencies),
+        "messages": messages,
+        "errors": sum(c.errors for c in clients),
+        "throughput": round(messages / elapsed, 1),
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 50)),
+            "p90": ms(percentile(latencies, 90)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(latencies[-1] if latencies else None),
+            "mean": ms(sum(latencies) / len(latencies) if latencies else None),
+        },
+    }
+
+
+def start_server(args):
+    """start a pynodered server on the bench nodes (or the modules of args.examples) and wait until it answers"""
+
+    if args.examples is None:
+        filenames = ["pynodered.bench_nodes"]
+    else:
+        filenames = sorted(str(p) for p in Path(args.examples).glob("*.py"))
+        if not filenames:
+            raise Exception("no python file in %s" % args.examples)
+    cmd = [sys.executable, "-m", "pynodered.server", "--noinstall", "--port", str(args.port),
+           "--server", args.server, "--threads", str(args.threads), "--workers", "0"] + filenames
+    process = subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+
+    url = "http://127.0.0.1:%i/" % args.port
+    deadline = time.time() + 30
+    while True:
+        if process.poll() is not None:
+            raise Exception("the server has stopped with the code %i: %s" % (process.returncode, " ".join(cmd)))
+        try:
+            urllib.request.urlopen(url + "map", timeout=1).read()
+            return process, url
+        except OSError:
+            if time.time() > deadline:
+                process.terminate()
+                raise Exception("the server does not answer on %s" % url)
+            time.sleep(0.2)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='pynodered-bench', description="load test of the pynodered server")
+    parser.add_argument('scenarios', nargs='*', help="scenarios to run among %s (default: all)" % ", ".join(scenarios))
+    parser.add_argument('--url', help="url of a running server. By default a server is started on pynodered.bench_nodes")
+    parser.add_argument('--examples', help="directory of the modules served by the started server instead of pynodered.bench_nodes "
+                                           "(they must define the nodes of the scenarios)")
+    parser.add_argument('--port', type=int, default=5099, help="port of the started server")
+    parser.add_argument('--server', choices=['auto', 'waitress', 'flask'], default='auto', help="HTTP server of the started server")
+    parser.add_argument('--threads', type=int, default=8, help="number of threads of the started server")
+    parser.add_argument('--codec', choices=list(codecs_by_name), default="json")
+    parser.add_argument('--transport', choices=['keepalive', 'http'], default='keepalive',
+                        help="'keepalive' reuses the connection of each client, 'http' opens a new connection for each request")
+    parser.add_argument('--concurrency', type=int, default=8, help="number of clients (Node-RED nodes) sending concurrently")
+    parser.add_argument('--batch', type=int, default=1, help="number of calls per JSON-RPC request")
+    parser.add_argument('--size', type=int, default=100, help="size of the payloads (characters or bytes)")
+    parser.add_argument('--rate', type=float, default=0,
+                        help="total number of messages per second. 0 sends as fast as possible (closed loop)")
+    parser.add_argument('--duration', type=float, default=5, help="duration of each scenario in seconds")
+    parser.add_argument('--output', help="write the results in this file instead of the standard output")
+    parser.add_argument('--verbose', action="store_true", help="show the output of the started server")
+    args = parser.parse_args(sys.argv[1:])
+
+    for scenario in args.scenarios:
+        if scenario not in scenarios:
+            parser.error("unknown scenario %s" % scenario)
+    args.scenarios = args.scenarios or list(scenarios)
+
+    process = None
+    url = args.url
+    if url is None:
+        process, url = start_server(args)
+    try:
+        results = [run_scenario(url, scenario, args) for scenario in args.scenarios]
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,42 @@
+"""Nodes served by pynodered-bench, the same as the nodes of the examples/ directory which is not installed with the package."""
+
+from pynodered import node_red, NodeProperty
+
+
+@node_red(category="bench")
+def lower_case(node, msg):
+
+    msg['payload'] = msg['payload'].lower()
+    return msg
+
+
+@node_red(category="bench", properties=dict(number=NodeProperty("Number", value="1")))
+def repeat(node, msg):
+
+    msg['payload'] = msg['payload'] * int(node.number.value)
+    return msg
+
+
+@node_red(category="bench", join=["x", "y"])
+def sum_topics(node, msg):
+
+    payloads = node.join(msg)  # waits for the messages with the topics x and y
+    msg['payload'] = sum(payloads)
+    return msg
+
+
+@node_red(category="bench", outputs=2, output_labels=["even", "odd"])
+def route(node, msg):
+
+    msg['selected_output'] = msg['payload'] % 2
+    return msg
+
+
+@node_red(category="bench")
+def reverse_buffer(node, msg):
+
+    payload = msg['payload']
+    if isinstance(payload, dict) and payload.get('type') == "Buffer":  # a Buffer sent with the json codec
+        payload = bytes(payload['data'])
+    msg['payload'] = payload[::-1]
+    return msg
@@ -0,0 +1,101 @@
+"""Codecs of the JSON-RPC requests and responses exchanged with the Node-RED nodes. The codec of a request is selected
+by its Content-Type header and the response is encoded with the same codec.
+
+- json: the default. It uses orjson if it is installed, the json module otherwise.
+- msgpack: a compact binary format (requires msgpack). Node-RED Buffers are received as bytes and bytes are sent back as Buffers,
+  instead of lists of integers in json.
+
+The results of the generator nodes are streamed in frames: one JSON object per line (NDJSON) or msgpack objects prefixed by their
+length (4 bytes, big-endian).
+"""
+
+import json
+import struct
+import decimal
+import datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def _default(obj):
+    # types not handled by the json encoders
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        return {"type": "Buffer", "data": list(bytes(obj))}  # as JSON.stringify(Buffer) in javascript
+    if hasattr(obj, "tolist"):  # numpy arrays and scalars
+        return obj.tolist()
+    raise TypeError("Object of type %s is not JSON serializable" % type(obj).__name__)
+
+
+class JSONCodec(object):
+    content_type = "application/json"
+
+    if orjson is not None:
+        @staticmethod
+        def loads(data):
+            return orjson.loads(data)
+
+        @staticmethod
+        def dumps(obj):
+            return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+    else:
+        @staticmethod
+        def loads(data):
+            return json.loads(data)
+
+        @staticmethod
+        def dumps(obj):
+            return json.dumps(obj, default=_default).encode()
+
+    @classmethod
+    def frame(cls, obj):
+        return cls.dumps(obj) + b"\n"  # the encoders do not emit new lines
+
+
+class MsgpackCodec(object):
+    content_type = "application/msgpack"
+
+    @staticmethod
+    def loads(data):
+        return msgpack.unpackb(data, raw=False)
+
+    @staticmethod
+    def dumps(obj):
+        return msgpack.packb(obj, use_bin_type=True, default=_msgpack_default)
+
+    @classmethod
+    def frame(cls, obj):
+        data = cls.dumps(obj)
+        return struct.pack(">I", len(data)) + data
+
+
+def _msgpack_default(obj):
+    if isinstance(obj, memoryview):
+        return obj.tobytes()
+    return _default(obj)
+
+
+codecs_by_name = {"json": JSONCodec, "msgpack": MsgpackCodec}
+
+codecs = {JSONCodec.content_type: JSONCodec}
+if msgpack is not None:
+    codecs[MsgpackCodec.content_type] = MsgpackCodec
+
+
+def get_codec(content_type):
+    """return the codec for the content type, JSONCodec if it is not given and None if it is not supported"""
+
+    if not content_type:
+        return JSONCodec
+    return codecs.get(content_type.split(";")[0].strip().lower())
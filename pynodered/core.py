@@ -1,8 +1,52 @@
 import os
+import asyncio
 import collections
+import collections.abc
+import concurrent.futures
+import contextvars
+import copy
+import functools
+import hashlib
+import inspect
 import json
+import threading
+import time
+import types
 from pathlib import Path
 
+from pynodered.ttldict import TTLDict
+from pynodered import aio, profiling, store
+from pynodered import state as node_state
+
+
+# options of pynodered that can be set in the 'package' dict of the modules. They are used to generate the nodes
+# and are not written in package.json.
+# transport: 'keepalive' reuses persistent connections to the server, 'http' opens a new connection for each message
+# max_sockets: maximum number of persistent connections of a Node-RED runtime to the server
+# batch_size: maximum number of messages sent to the server in one request (JSON-RPC batch). 1 disables batching. By default (None),
+#   the coroutine nodes send batches of ASYNC_BATCH_SIZE messages, which wait together in one server thread, the nodes declared with
+#   batch=dict(max_size=...) send batches of max_size messages, and the others send one message per request
+# batch_window: time in ms to wait for more messages before sending an incomplete batch
+# codec: 'json' or 'msgpack' (binary, Buffers are received as bytes by Python; requires msgpack in Python and @msgpack/msgpack in Node-RED)
+# socket: path of the Unix domain socket of the server instead of the port, set by the --socket option of the server
+# endpoints: URLs of the servers running the nodes (http://host:port, or unix:/path of a socket), set by the shard map of the server
+# balance: choice of the endpoint of each request, 'least_outstanding' (the fewest requests in progress) or 'round_robin'
+package_options = {
+    "transport": "keepalive",
+    "max_sockets": 8,
+    "batch_size": None,
+    "batch_window": 5,
+    "codec": "json",
+    "socket": None,
+    "endpoints": None,
+    "balance": "least_outstanding",
+}
+ASYNC_BATCH_SIZE = 32
+
+
+BoundProperty = collections.namedtuple("BoundProperty", ["name", "title", "type", "value", "values", "required", "input_type"])
+BoundProperty.__doc__ = "an immutable node property holding the value configured in Node-RED. Returned by NodeProperty.bind."
+
 
 class NodeProperty(object):
     """a Node property. This is usually use to decalre field in a class deriving from RNBaseNode.
@@ -25,6 +69,9 @@ class NodeProperty(object):
 
         return {a: getattr(self, a) for a in args}
 
+    def bind(self, value):
+        return BoundProperty(self.name, self.title or self.name, self.type, value, self.values, self.required, self.input_type)
+
 
 class FormMetaClass(type):
     def __new__(cls, name, base, attrs):
@@ -37,6 +84,8 @@ class FormMetaClass(type):
                 properties.append(attr)
         # sorting manually corresponds to the definision order of Fields.
         new_class.properties = properties
+        new_class.is_async = inspect.iscoroutinefunction(getattr(new_class, "work", None))
+        new_class.is_generator = inspect.isgeneratorfunction(getattr(new_class, "work", None))
         return new_class
 
 
@@ -46,25 +95,70 @@ class RNBaseNode(metaclass=FormMetaClass):
     """
 
     rednode_template = "httprequest"
+    executor = "thread"
+    outputs = 1
+    output_labels = []
+    max_instances = 1000  # maximum number of Node-RED nodes of this class kept in memory by the server
+    concurrency = None  # maximum number of concurrent calls of work
+    max_queue = None  # maximum number of calls waiting when concurrency is reached, the others are rejected as busy
+    overflow = "buffer"  # what the Node-RED node does with the messages rejected as busy: "buffer", "drop_oldest" or "drop_newest"
+    max_buffer = 1000  # maximum number of messages kept by the Node-RED node while the Python node is busy
+    cache = None  # ResultCache memoizing the results of work
+    batch = None  # dict(max_size=..., max_wait_ms=...) to call work with lists of msgs
+    store = False  # keep the payloads of the results in the server and send handles to Node-RED
 
     # based on SFNR code (GPL v3)
     @classmethod
-    def install(cls, node_dir, port):
+    def install(cls, node_dir, port, options=None, manifest=None):
+        """write the javascript and html files of the node in node_dir. With a manifest (InstallManifest), the files are
+        only written if the node has changed since they were installed. Return True if the files have been written."""
 
-        try:
-            os.mkdir(node_dir)
-        except OSError:
-            pass
+        options = options or {}
+        files = [node_dir / ("%s.%s" % (cls.name, ext)) for ext in ['js', 'html']]
+        signature = cls.signature(port, options)
+        if manifest is not None and manifest.is_installed(cls.name, signature, files):
+            return False
+
+        os.makedirs(node_dir, exist_ok=True)
 
-        for ext in ['js', 'html']:
+        for ext, out_path in zip(['js', 'html'], files):
             in_path = Path(__file__).parent / "templates" / ("%s.%s.in" % (cls.rednode_template, ext))
-            out_path = node_dir / ("%s.%s" % (cls.name, ext))
 
-            cls._install_template(in_path, out_path, node_dir, port)
+            cls._install_template(in_path, out_path, node_dir, port, options)
+
+        if manifest is not None:
+            manifest.installed(cls.name, signature)
+        return True
+
+    @classmethod
+    def signature(cls, port, options):
+        """return a hash of everything the installed files depend on: the attributes of the class, the options and the templates"""
+
+        opts = dict(package_options)
+        opts.update(options)
+        content = {
+            'template': _template_hash(cls.rednode_template),
+            'port': port,
+            'options': opts,
+            'properties': [p.as_dict("name", "title", "type", "value", "values", "required", "input_type") for p in cls.properties],
+            'attributes': [getattr(cls, a, None) for a in ("name", "title", "icon", "color", "category", "description",
+                                                           "outputs", "output_labels", "overflow", "max_buffer", "is_generator",
+                                                           "is_async", "batch")],
+        }
+        return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+    @classmethod
+    def request_batch_size(cls, opts):
+        """return the maximum number of messages the Node-RED node sends in one request"""
+        if opts['batch_size'] is not None:
+            return int(opts['batch_size'])
+        if cls.batch is not None:
+            return cls.batch['max_size']  # a server-side batch can only hold the calls waiting in the server threads otherwise
+        return ASYNC_BATCH_SIZE if cls.is_async else 1
 
     # based on SFNR code (GPL)
     @classmethod
-    def _install_template(cls, in_path, out_path, node_dir, port):
+    def _install_template(cls, in_path, out_path, node_dir, port, options):
 
         defaults = {}
         form = ""
@@ -114,7 +208,21 @@ class RNBaseNode(metaclass=FormMetaClass):
 
         t = open(in_path).read()
 
+        opts = dict(package_options)
+        opts.update(options)
+        endpoints = opts['endpoints'] or ["unix:" + opts['socket'] if opts['socket'] else "http://localhost:%s" % port]
+
         t = t % {'port': port,
+                 'transport': opts['transport'],
+                 'max_sockets': int(opts['max_sockets']),
+                 'batch_size': cls.request_batch_size(opts),
+                 'batch_window': float(opts['batch_window']),
+                 'codec': opts['codec'],
+                 'endpoints': json.dumps([endpoint_options(endpoint) for endpoint in endpoints]),
+                 'balance': opts['balance'],
+                 'overflow': cls.overflow,
+                 'max_buffer': int(cls.max_buffer),
+                 'streaming': "true" if cls.is_generator else "false",
                  'name': cls.name,
                  'title': cls.title,
                  'icon': cls.icon,
@@ -131,12 +239,512 @@ class RNBaseNode(metaclass=FormMetaClass):
 
         open(out_path, 'w').write(t)
 
-    def run(self, msg, config):
+    def configure(self, config):
+        """set the properties to the values of the configuration of a Node-RED node. The class is not modified."""
 
         for p in self.properties:
-            p.value = config.get(p.name)
+            setattr(self, p.name, p.bind(config.get(p.name)))
+        self.config = types.MappingProxyType(dict(config))
+        return self
+
+    def on_start(self):
+        """called when the server has created and configured the node for a Node-RED node, before the first message.
+        Override it to open connections, load models, ..."""
+        pass
+
+    def on_close(self):
+        """called when the Node-RED node is closed (e.g. the flows are redeployed) or when the server drops the node.
+        Override it to release the resources."""
+        pass
+
+    def run(self, msg, config):
+
+        return copy.copy(self).configure(config).work(store.resolve(msg))
+
+
+def endpoint_options(endpoint):
+    """return the url and the socket path of an endpoint of a server: http://host:port or unix:/path of the socket"""
+    if endpoint.startswith("unix:"):
+        return {"url": "http://localhost/", "socketPath": os.path.abspath(endpoint[len("unix:"):])}
+    if not endpoint.startswith("http://"):
+        raise Exception("the endpoint %s must be http://host:port or unix:/path of a socket" % endpoint)
+    return {"url": endpoint.rstrip("/") + "/", "socketPath": ""}
+
+
+@functools.lru_cache()
+def _template_hash(template):
+    # the templates and the code rendering them (this file)
+    h = hashlib.sha1()
+    for path in [Path(__file__).parent / "templates" / ("%s.%s.in" % (template, ext)) for ext in ['js', 'html']] + [Path(__file__)]:
+        h.update(path.read_bytes())
+    return h.hexdigest()
+
+
+class InstallManifest(object):
+    """record of the nodes installed in a node directory (the signature of each node) to skip the unchanged nodes at startup and
+    remove the files of the nodes that no longer exist. It is saved in the .pynodered.json file of the directory."""
+
+    filename = ".pynodered.json"
+
+    def __init__(self, node_dir):
+        self.node_dir = Path(node_dir)
+        try:
+            with open(self.node_dir / self.filename) as f:
+                self.nodes = json.load(f).get('nodes', {})
+        except (OSError, ValueError):
+            self.nodes = {}
+        self.current = {}  # nodes installed or found up to date by this run
+
+    def is_installed(self, name, signature, files):
+        if self.nodes.get(name) == signature and all(os.path.exists(f) for f in files):
+            self.current[name] = signature
+            return True
+        return False
+
+    def installed(self, name, signature):
+        self.current[name] = signature
+
+    def remove(self, name):
+        """forget a node, its files are removed by save()"""
+        self.current.pop(name, None)
+
+    def write_package(self, package):
+        """write package.json if it has changed. Return True if it has been written."""
+
+        text = json.dumps(package)
+        path = self.node_dir / "package.json"
+        try:
+            if path.read_text() == text:
+                return False
+        except OSError:
+            pass
+        os.makedirs(self.node_dir, exist_ok=True)
+        path.write_text(text)
+        return True
+
+    def save(self):
+        """remove the files of the nodes that have not been installed by this run and save the manifest"""
+
+        for name in set(self.nodes) - set(self.current):
+            for ext in ['js', 'html']:
+                path = self.node_dir / ("%s.%s" % (name, ext))
+                if path.exists():
+                    print("removing %s" % path)
+                    path.unlink()
+        os.makedirs(self.node_dir, exist_ok=True)
+        with open(self.node_dir / self.filename, "w") as f:
+            json.dump({'nodes': self.current}, f, indent=1)
+        self.nodes = dict(self.current)
+
+
+class DeadlineExceeded(Exception):
+    """raised when the deadline of a msg has passed, the Node-RED node has stopped waiting for the result"""
+    pass
+
+
+class Deadline(object):
+    """the time at which the Node-RED node stops waiting for the result of a msg (timeout in seconds, None: no deadline).
+The calls whose deadline has passed while they were waiting for their turn are skipped, the coroutine functions are cancelled.
+The other functions cannot be interrupted but can check the deadline of the msg they process, given by get_deadline().
+"""
+
+    __slots__ = ("at",)
+
+    def __init__(self, timeout=None):
+        self.at = None if timeout is None else time.monotonic() + timeout
+
+    def remaining(self):
+        """return the time left in seconds (None if there is no deadline)"""
+        return None if self.at is None else self.at - time.monotonic()
+
+    @property
+    def expired(self):
+        return self.at is not None and time.monotonic() >= self.at
+
+    def check(self):
+        """raise DeadlineExceeded if the deadline has passed"""
+        if self.expired:
+            raise DeadlineExceeded()
+
+    def call(self, f, *args):
+        """call f if the deadline has not passed, get_deadline() returns this deadline during the call"""
+        self.check()
+        token = _current_deadline.set(self)
+        try:
+            return f(*args)
+        finally:
+            _current_deadline.reset(token)
+
+    def iterate(self, results):
+        """iterate over a generator until the deadline passes"""
+        try:
+            while True:
+                self.check()
+                token = _current_deadline.set(self)
+                try:
+                    result = next(results)
+                except StopIteration:
+                    return
+                finally:
+                    _current_deadline.reset(token)
+                yield result
+        finally:
+            results.close()
 
-        return self.work(msg)
+    async def wait(self, awaitable):
+        """await the awaitable, cancelled when the deadline passes"""
+        if self.expired:
+            if inspect.iscoroutine(awaitable):
+                awaitable.close()  # never started
+            raise DeadlineExceeded()
+        token = _current_deadline.set(self)
+        try:
+            if self.at is None:
+                return await awaitable
+            try:
+                return await asyncio.wait_for(awaitable, self.remaining())
+            except asyncio.TimeoutError:
+                if self.expired:
+                    raise DeadlineExceeded() from None
+                raise
+        finally:
+            _current_deadline.reset(token)
+
+    @staticmethod
+    def latest(deadlines):
+        """return the latest of the deadlines"""
+        if any(deadline.at is None for deadline in deadlines):
+            return NO_DEADLINE
+        return max(deadlines, key=lambda deadline: deadline.at)
+
+
+NO_DEADLINE = Deadline()
+_current_deadline = contextvars.ContextVar("pynodered_deadline", default=NO_DEADLINE)
+
+
+def get_deadline():
+    """return the Deadline of the msg being processed. Long computations can stop early when the Node-RED node no longer waits:
+
+        for chunk in chunks:
+            get_deadline().check()
+            ...
+    """
+    return _current_deadline.get()
+
+
+class Busy(Exception):
+    """raised when a node has too many calls running and waiting"""
+    pass
+
+
+class Admission(object):
+    """limit the number of calls of a node running at the same time (concurrency) and waiting for their turn (max_queue).
+The calls beyond are rejected with Busy, so that an overloaded node answers immediately instead of piling up requests.
+"""
+
+    def __init__(self, concurrency=None, max_queue=None):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.limit = None if concurrency is None or max_queue is None else concurrency + max_queue
+        self.admitted = 0  # running and waiting calls
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self.semaphore = threading.BoundedSemaphore(concurrency) if concurrency is not None else None
+
+    def admit(self):
+        with self.lock:
+            if self.limit is not None and self.admitted >= self.limit:
+                self.rejected += 1
+                raise Busy()
+            self.admitted += 1
+
+    def release(self):
+        with self.lock:
+            self.admitted -= 1
+
+    def run(self, f, *args, deadline=NO_DEADLINE):
+        """run f in the calling thread once the concurrency allows it, unless the deadline has passed meanwhile"""
+        self.admit()
+        try:
+            return self.execute(f, *args, deadline=deadline)
+        finally:
+            self.release()
+
+    def execute(self, f, *args, deadline=NO_DEADLINE):
+        """run f once the concurrency allows it, for calls admitted separately"""
+        if self.semaphore is None:
+            return deadline.call(f, *args)
+        self._acquire(deadline)
+        try:
+            return deadline.call(f, *args)
+        finally:
+            self.semaphore.release()
+
+    def _acquire(self, deadline):
+        # wait for a turn until the deadline at most, the Node-RED node no longer waits for the result after
+        remaining = deadline.remaining()
+        if not self.semaphore.acquire(timeout=None if remaining is None else max(remaining, 0)):
+            raise DeadlineExceeded()
+
+    def iterate(self, f, *args, deadline=NO_DEADLINE):
+        """like run for a generator function f. The call is admitted now and released when the iteration ends (or the generator
+        is closed), so that the limits apply to the whole iteration"""
+        self.admit()
+
+        def iteration():
+            try:
+                if self.semaphore is None:
+                    yield from deadline.iterate(f(*args))
+                else:
+                    self._acquire(deadline)
+                    try:
+                        yield from deadline.iterate(f(*args))
+                    finally:
+                        self.semaphore.release()
+            finally:
+                self.release()
+        return iteration()
+
+
+class Batcher(object):
+    """group the msgs sent to a node to call work once with a list of up to max_size msgs, at most max_wait_ms after the first msg
+of the batch. work must return a list with the result of each msg, in the same order. submit returns a Future of the result of the msg.
+The full batches run in the thread of the last msg, the others in the executor of the event loop when their time is up. The msgs whose
+deadline has passed before the call are left out of the batch.
+"""
+
+    def __init__(self, work, admission, max_size=32, max_wait_ms=10):
+        self.work = work
+        self.admission = admission
+        self.max_size = max_size
+        self.max_wait = max_wait_ms / 1000
+        self.lock = threading.Lock()
+        self.msgs = []
+        self.futures = []
+        self.deadlines = []
+        self.generation = 0  # number of the current batch
+
+    def submit(self, msg, deadline=NO_DEADLINE):
+        self.admission.admit()  # each msg is admitted, the concurrency applies to the calls of work
+        future = concurrent.futures.Future()
+        with self.lock:
+            self.msgs.append(msg)
+            self.futures.append(future)
+            self.deadlines.append(deadline)
+            if len(self.msgs) >= self.max_size:
+                batch = self._take()
+            else:
+                batch = None
+                if len(self.msgs) == 1:
+                    loop = aio.get_loop()
+                    loop.call_soon_threadsafe(loop.call_later, self.max_wait, self._timeout, self.generation)
+        if batch is not None:
+            self._run(*batch)
+        return future
+
+    def _take(self):
+        # must be called with the lock
+        batch = self.msgs, self.futures, self.deadlines
+        self.msgs, self.futures, self.deadlines = [], [], []
+        self.generation += 1
+        return batch
+
+    def _timeout(self, generation):
+        # called in the event loop
+        with self.lock:
+            if generation != self.generation or not self.msgs:
+                return  # the batch was full and has already run
+            batch = self._take()
+        aio.get_loop().run_in_executor(None, self._run, *batch)
+
+    def _run(self, msgs, futures, deadlines):
+        try:
+            self.admission.execute(self._call, msgs, futures, deadlines)
+        finally:
+            for _ in msgs:
+                self.admission.release()
+
+    def _call(self, msgs, futures, deadlines):
+        # called once the concurrency allows it
+        live = list()
+        for msg, future, deadline in zip(msgs, futures, deadlines):
+            if deadline.expired:
+                future.set_exception(DeadlineExceeded())
+            else:
+                live.append((msg, future, deadline))
+        if not live:
+            return
+        msgs, futures, deadlines = zip(*live)
+        deadline = Deadline.latest(deadlines)
+        try:
+            results = deadline.call(self.work, list(msgs))
+            if inspect.isawaitable(results):
+                results = aio.submit(deadline.wait(results)).result()
+            if not isinstance(results, collections.abc.Sequence) or len(results) != len(msgs):
+                raise Exception("a batch function must return a list with one result per msg")
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+        else:
+            for future, result in zip(futures, results):
+                future.set_result(result)
+
+
+class UnknownNodeConfig(Exception):
+    """raised when a message refers to a Node-RED node whose configuration has not been registered (or has changed)"""
+    pass
+
+
+def config_etag(config):
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+class _NodeEntry(object):
+    __slots__ = ("etag", "config", "node", "batcher")
+
+    def __init__(self, etag, config):
+        self.etag = etag
+        self.config = config
+        self.node = None
+        self.batcher = None
+
+
+class NodeRegistry(object):
+    """keep one instance of a node class per Node-RED node. The Node-RED nodes register their configuration once with
+an etag (a hash of the configuration) and then send only their id and the etag with each message. The instances are created
+on the first message and at most maxsize instances are kept, the least recently used are closed.
+"""
+
+    def __init__(self, cls, maxsize=None):
+        self.cls = cls
+        self.maxsize = maxsize or cls.max_instances
+        self.entries = collections.OrderedDict()  # node id -> _NodeEntry
+        self.lock = threading.Lock()
+        self.admission = Admission(cls.concurrency, cls.max_queue)
+        self.semaphore = None  # limit the concurrency of the coroutine functions, created in the event loop
+
+    def run(self, msg=None, node_id=None, etag=None, config=None, close=False, timeout=None):
+        """register the configuration if given, process the msg if given, or close the node. timeout is the time in ms
+        the Node-RED node waits for the result. For coroutine functions, the result is a concurrent.futures.Future."""
+
+        if close:
+            self.close(node_id, etag)
+            return None
+
+        if config is not None:
+            if etag is None:
+                etag = config_etag(config)
+            if node_id is None:
+                node_id = config.get('id')
+            entry = self.register(node_id, etag, config)
+        else:
+            with self.lock:
+                entry = self.entries.get(node_id)
+                if entry is None or (etag is not None and entry.etag != etag):
+                    raise UnknownNodeConfig(node_id)
+                self.entries.move_to_end(node_id)
+
+        if msg is None:
+            return None
+        deadline = Deadline(timeout / 1000) if timeout else NO_DEADLINE
+        node = entry.node or self._start(node_id, entry)
+        cache = self.cls.cache
+        if cache is None or not isinstance(msg, dict):
+            return self._work(entry, node, store.resolve(msg), deadline)
+
+        key = cache.make_key(entry.etag, msg)  # with the handle of the payload if any
+        result = cache.get(key, msg)
+        if result is not ResultCache.MISS:
+            return result
+        original = copy.deepcopy(msg)  # work usually modifies msg, possibly its nested fields
+        result = self._work(entry, node, store.resolve(msg), deadline)
+        if isinstance(result, concurrent.futures.Future):
+            def done(future):
+                if future.exception() is None:
+                    cache.put(key, original, future.result())
+            result.add_done_callback(done)
+        else:
+            cache.put(key, original, result)
+        return result
+
+    def _work(self, entry, node, msg, deadline):
+        if self.cls.batch is not None:
+            return (entry.batcher or self._batcher(entry, node)).submit(msg, deadline)
+        if self.cls.is_generator:
+            return self.admission.iterate(node.work, msg, deadline=deadline)
+        if self.cls.is_async:
+            self.admission.admit()
+            return aio.submit(self._limit(node.work, msg, deadline))
+        profile = profiling.get_profile(self.cls.name)
+        if profile is not None:
+            return self.admission.run(profile.run, node.work, msg, deadline=deadline)
+        return self.admission.run(node.work, msg, deadline=deadline)
+
+    async def _limit(self, work, msg, deadline):
+        try:
+            if self.cls.concurrency is None:
+                return await deadline.wait(work(msg))
+            if self.semaphore is None:
+                self.semaphore = asyncio.Semaphore(self.cls.concurrency)
+            async with self.semaphore:
+                return await deadline.wait(work(msg))
+        finally:
+            self.admission.release()
+
+    def register(self, node_id, etag, config):
+        closed = []
+        with self.lock:
+            entry = self.entries.get(node_id)
+            if entry is not None and entry.etag == etag:
+                self.entries.move_to_end(node_id)
+                return entry
+            if entry is not None:
+                closed.append(entry)
+            entry = _NodeEntry(etag, config)
+            self.entries[node_id] = entry
+            self.entries.move_to_end(node_id)
+            while len(self.entries) > self.maxsize:
+                closed.append(self.entries.popitem(last=False)[1])
+
+        for e in closed:
+            if e.node is not None:
+                e.node.on_close()
+        return entry
+
+    def _batcher(self, entry, node):
+        with self.lock:
+            if entry.batcher is None:
+                entry.batcher = Batcher(node.work, self.admission, **self.cls.batch)
+            return entry.batcher
+
+    def _start(self, node_id, entry):
+        # the setup of the node is done without the lock
+        node = self.cls().configure(entry.config)
+        node.on_start()
+        with self.lock:
+            if entry.node is None and self.entries.get(node_id) is entry:
+                entry.node = node
+                return node
+            current = entry.node
+        node.on_close()  # another thread was faster or the entry has been dropped meanwhile
+        return current or node
+
+    def close(self, node_id, etag=None):
+        with self.lock:
+            entry = self.entries.get(node_id)
+            if entry is None or (etag is not None and entry.etag != etag):
+                return
+            del self.entries[node_id]
+        if entry.node is not None:
+            entry.node.on_close()
+
+    def close_all(self):
+        with self.lock:
+            entries = list(self.entries.values())
+            self.entries.clear()
+        for entry in entries:
+            if entry.node is not None:
+                entry.node.on_close()
 
 
 class NodeWaiting(Exception):
@@ -159,44 +767,150 @@ class Join(object):
 with the excepted_topics arrive. While waiting the Join instance raise NodeWaiting exception which is understood by the server which then silently inform node-red
 to continue without error. Once all the message with the expected topics are arrived, the instance return the messages list in the order of expected_topics.
 
+The incomplete groups of messages are dropped after ttl seconds without new message (if ttl is not None) and when more than max_pending
+groups are waiting (the least recently updated is dropped). The dropped groups are counted in the dropped attribute and passed to
+on_drop(msgid, payloads) if given, payloads being None for the missing topics.
+
+The groups are kept by the backend of pynodered.state given by state, by default the backend of the server (in the memory of the process
+unless the server has the --state-db option).
 """
 
-    def __init__(self, expected_topics):
-        self.mem = collections.defaultdict(dict)
-        self.expected_topics = expected_topics
+    def __init__(self, expected_topics, ttl=None, max_pending=10000, on_drop=None, state=None):
+        self.expected_topics = list(expected_topics)
+        self.index = {topic: i for i, topic in enumerate(self.expected_topics)}
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.on_drop = on_drop
+        self.dropped = 0
+        self.state = state
+        self.name = None  # namespace of the groups in the backend, set to the name of the node by node_red
+        self._groups = None
+        self.lock = threading.Lock()
+
+    @property
+    def groups(self):
+        # created on the first use, once the backend of the server is set
+        if self._groups is None:
+            with self.lock:
+                if self._groups is None:
+                    self._groups = (self.state or node_state.default).groups(self.name or ",".join(self.expected_topics),
+                                                                             len(self.expected_topics), self.ttl,
+                                                                             self.max_pending, self._drop)
+        return self._groups
 
     def __call__(self, msg):
-        self.push(msg)
-        if not self.ready(msg):
+        msgs = self.push(msg)
+        if msgs is None:
             raise NodeWaiting
-        return self.pop(msg)
+        return msgs
 
     def push(self, msg):
-        self.mem[msg['_msgid']][msg['topic']] = msg['payload']
+        """store the payload of the message and return the payloads in the order of expected_topics when the group is complete,
+        None otherwise"""
 
-    def ready(self, msg):
-        for topic in self.expected_topics:
-            if topic not in self.mem[msg['_msgid']]:
-                return False
-        return True
+        i = self.index.get(msg.get('topic'))
+        if i is None:
+            return None  # unexpected topic
+        return self.groups.push(msg['_msgid'], i, msg['payload'])
 
-    def get_messages(self, msg):
-        return [self.mem[msg['_msgid']][topic] for topic in self.expected_topics]
+    def _drop(self, msgid, payloads):
+        self.dropped += 1
+        if self.on_drop is not None:
+            self.on_drop(msgid, payloads)
 
-    def pop(self, msg):
-        msgs = self.mem.pop(msg['_msgid'])
-        return [msgs[topic] for topic in self.expected_topics]
+    def pending(self):
+        """return the number of incomplete groups"""
+        return self.groups.pending()
 
     def clean(self, msg):
-        del self._cache[msg['_msgid']]
+        """forget the incomplete group of the message"""
+        self.groups.discard(msg['_msgid'])
+
+
+class ResultCache(object):
+    """memoize the results of the work function of a node for the messages with the same key fields (e.g. payload) and the same
+node configuration. The least recently used results are evicted beyond maxsize, and the results expire after ttl seconds (None: never).
+On a hit, the fields modified by work are applied to the new msg, so that its other fields (_msgid, ...) are kept.
+"""
+
+    MISS = object()
+
+    def __init__(self, maxsize=1024, ttl=None, key=("payload",)):
+        self.key = [key] if isinstance(key, str) else list(key)
+        self.mem = TTLDict(ttl, maxsize=int(maxsize))
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, etag, msg):
+        fields = json.dumps([msg.get(k) for k in self.key], sort_keys=True, default=repr)
+        return hashlib.sha1((etag + fields).encode()).digest()
+
+    def get(self, key, msg):
+        try:
+            changes = self.mem[key]
+            self.mem.move_to_end(key)
+        except KeyError:
+            self.misses += 1
+            return self.MISS
+        self.hits += 1
+        if not isinstance(changes, _Diff):
+            return copy.deepcopy(changes)  # None or a result which is not a msg (a list or tuple of msgs, ...)
+        result = dict(msg)
+        result.update(copy.deepcopy(changes.updated))  # the results may be modified by the next nodes
+        for k in changes.removed:
+            result.pop(k, None)
+        return result
+
+    def put(self, key, msg, result):
+        if isinstance(result, dict):
+            updated = {k: v for k, v in result.items() if k not in msg or not _same(msg[k], v)}
+            removed = [k for k in msg if k not in result]
+            self.mem[key] = _Diff(copy.deepcopy(updated), removed)
+        else:
+            self.mem[key] = copy.deepcopy(result)
+
+
+class _Diff(object):
+    # the changes made by work to the msg, kept by ResultCache in place of the resulting msg
+    __slots__ = ("updated", "removed")
+
+    def __init__(self, updated, removed):
+        self.updated = updated
+        self.removed = removed
+
+
+def _same(a, b):
+    try:
+        return a is b or bool(a == b)
+    except Exception:
+        return False  # e.g. numpy arrays
 
 
 def node_red(name=None, title=None, category="default", description=None,
-             join=None, baseclass=RNBaseNode, properties=None, icon=None, color=None, outputs=1, output_labels=None):
+             join=None, baseclass=RNBaseNode, properties=None, icon=None, color=None, outputs=1, output_labels=None,
+             executor=None, concurrency=None, max_queue=None, overflow=None, max_buffer=None, cache=None, batch=None,
+             store=None):
     """decorator to make a python function available in node-red. The function must take two arguments, node and msg.
     msg is a dictionary with all the pairs of keys and value sent by node-red. Most interesting keys are 'payload', 'topic' and 'msgid_'.
     The node argument is an instance of the underlying class created by this decorator. It can be useful when you have a defined a common subclass
-    of RNBaseNode that provided specific features for your application (usually database connection and similar). """
+    of RNBaseNode that provided specific features for your application (usually database connection and similar).
+    The executor argument set to "process" runs the function in a pool of worker processes instead of the server threads. This is useful
+    for CPU-bound functions (the GIL limits the server process to one core) but adds the cost of inter-process communication.
+    The function can be a coroutine function (async def). It then runs in a shared event loop.
+    concurrency limits the number of calls running at the same time and max_queue (with concurrency) the number of calls waiting
+    for their turn. The calls beyond are rejected as busy and the Node-RED node buffers them (up to max_buffer) and sends them again
+    later. When its buffer is full, overflow="buffer" reports an error, overflow="drop_oldest" drops the oldest message.
+    overflow="drop_newest" drops the rejected messages without buffering.
+    cache memoizes the results of pure functions, for instance cache=dict(maxsize=1000, ttl=3600, key=["payload", "topic"]) (see
+    ResultCache, the default key is the payload). The function is not called for the messages with the same key fields and
+    node configuration as a cached result.
+    The function can be a generator yielding several msgs. They are sent by the Node-RED node as they come, to the output given by
+    msg['selected_output'] if any.
+    batch=dict(max_size=32, max_wait_ms=10) calls the function with a list of msgs instead of a msg, for vectorized processing.
+    The function must return the list of the results. The msgs received by the server are grouped until max_size msgs or for at
+    most max_wait_ms (see Batcher).
+    store=True keeps the payloads of the results in the server and sends a handle to Node-RED instead. The next Python nodes receive the
+    payload, the other Node-RED nodes need the materialize node of pynodered.materialize (see pynodered.store). """
 
     def wrapper(func):
         attrs = dict()
@@ -217,10 +931,51 @@ def node_red(name=None, title=None, category="default", description=None,
         if join is not None:
             if isinstance(join, Join):
                 attrs['join'] = join
-            elif isinstance(join, collections.Sequence):
+            elif isinstance(join, collections.abc.Sequence):
                 attrs['join'] = Join(join)
             else:
                 raise Exception("join must be a Join object or a sequence of topic (str)")
+            if attrs['join'].name is None:
+                attrs['join'].name = attrs['name']
+
+        attrs['outputs'] = outputs
+        if output_labels is not None:
+            attrs['output_labels'] = output_labels
+
+        if executor is not None:
+            if executor not in ("thread", "process"):
+                raise Exception("executor must be 'thread' or 'process'")
+            attrs['executor'] = executor
+
+        if concurrency is not None:
+            attrs['concurrency'] = int(concurrency)
+        if max_queue is not None:
+            if attrs.get('concurrency', getattr(baseclass, "concurrency", None)) is None:
+                raise ValueError("max_queue bounds the calls waiting for their turn, it requires concurrency")
+            attrs['max_queue'] = int(max_queue)
+        if max_buffer is not None:
+            attrs['max_buffer'] = int(max_buffer)
+        if overflow is not None:
+            if overflow not in ("buffer", "drop_oldest", "drop_newest"):
+                raise Exception("overflow must be 'buffer', 'drop_oldest' or 'drop_newest'")
+            attrs['overflow'] = overflow
+
+        if cache is not None:
+            if not isinstance(cache, dict):
+                raise Exception("cache must be a dict with the optional keys maxsize, ttl and key")
+            if inspect.isgeneratorfunction(func):
+                raise Exception("the results of a generator function cannot be cached")
+            attrs['cache'] = ResultCache(**cache)
+
+        if batch is not None:
+            if not isinstance(batch, dict) or not set(batch) <= {"max_size", "max_wait_ms"}:
+                raise Exception("batch must be a dict with the optional keys max_size and max_wait_ms")
+            if inspect.isgeneratorfunction(func) or attrs.get('executor') == "process":
+                raise Exception("a batch function cannot be a generator or run in worker processes")
+            attrs['batch'] = dict(max_size=int(batch.get("max_size", 32)), max_wait_ms=float(batch.get("max_wait_ms", 10)))
+
+        if store is not None:
+            attrs['store'] = bool(store)
 
         if properties is not None:
             if not isinstance(properties, dict):
@@ -235,6 +990,68 @@ def node_red(name=None, title=None, category="default", description=None,
 
     return wrapper
 
+
+class Pipeline(RNBaseNode):
+    """base class of the nodes created by node_red_pipeline. The steps are node classes run one after the other on the msg."""
+
+    steps = ()
+
+    def configure(self, config):
+        super().configure(config)
+        self.instances = [step().configure(config) for step in self.steps]
+        return self
+
+    def on_start(self):
+        for instance in self.instances:
+            instance.on_start()
+
+    def on_close(self):
+        for instance in self.instances:
+            instance.on_close()
+
+    def run_steps(self, msg):
+        last = len(self.instances) - 1
+        deadline = get_deadline()
+        for i, instance in enumerate(self.instances):
+            deadline.check()
+            result = instance.work(msg)  # NodeWaiting stops the pipeline
+            if inspect.isawaitable(result):
+                result = aio.submit(deadline.wait(result)).result()
+            if i == last or not isinstance(result, dict):
+                return result  # the last result, None to send nothing, or a list of msgs for several outputs
+            output = result.pop('selected_output', 0)
+            if output:
+                result['selected_output'] = output  # leave the pipeline by this output
+                return result
+            msg = result
+
+
+def node_red_pipeline(*steps, name=None, **kwargs):
+    """make one Node-RED node of several nodes (created with node_red or classes deriving from RNBaseNode) which are called one after
+    the other in the server, in a single request. The msg returned by a step is given to the next step. A step returning None, a list
+    or a msg with a selected_output other than 0 ends the pipeline and its result is sent by the node. The properties of the steps are
+    the properties of the node. The other arguments are those of node_red. """
+
+    if not steps or name is None:
+        raise Exception("a pipeline needs a name and at least one step")
+    properties = dict()
+    for step in steps:
+        if step.is_generator or step.batch is not None:
+            raise Exception("the step %s of the pipeline %s cannot be a generator or a batch function" % (step.name, name))
+        for p in step.properties:
+            if properties.get(p.name, p) is not p:
+                raise Exception("the property %s is defined by several steps of the pipeline %s" % (p.name, name))
+            properties[p.name] = p
+    kwargs.setdefault('outputs', max(step.outputs for step in steps))
+    kwargs.setdefault('description', "pipeline of %s" % ", ".join(step.name for step in steps))
+
+    def pipeline(node, msg):
+        return node.run_steps(msg)
+
+    cls = node_red(name=name, baseclass=Pipeline, properties=properties, **kwargs)(pipeline)
+    cls.steps = tuple(steps)
+    return cls
+
 # @node_red(name="myname", title="mytitle")
 # def mynode(msg=None):
 #     """madoc"""
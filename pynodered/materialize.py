@@ -0,0 +1,14 @@
+"""The materialize node, to give the payloads kept in the server (see pynodered.store) to the Node-RED nodes which are not written in
+Python. Add this module to the command line of the server:
+
+    $ pynodered pynodered.materialize mynodes.py
+"""
+
+from pynodered.core import node_red
+
+
+@node_red(category="pynodered")
+def materialize(node, msg):
+    """Replace the handle of the payload kept in the pynodered server by the payload."""
+
+    return msg  # the handle has been resolved before calling the function
@@ -0,0 +1,192 @@
+"""Metrics of the nodes (calls, errors, latency, ...) exposed in the Prometheus text format by the /metrics endpoint of the server.
+The methods registered in the JSON-RPC dispatcher are wrapped by instrument(), which costs a few counter updates per call.
+"""
+
+import bisect
+import inspect
+import threading
+import time
+from concurrent.futures import Future
+
+from pynodered.core import NodeWaiting, Busy, UnknownNodeConfig, DeadlineExceeded
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+class Histogram(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        # must be called with the lock of the NodeMetrics
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name, labels):
+        cumulative = 0
+        for bound, count in zip(self.buckets + ("+Inf",), self.counts):
+            cumulative += count
+            yield '%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cumulative)
+        yield '%s_sum{%s} %s' % (name, labels, self.sum)
+        yield '%s_count{%s} %d' % (name, labels, self.count)
+
+
+class NodeMetrics(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0
+        self.expired = 0
+        self.in_flight = 0
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.payload_size = Histogram(SIZE_BUCKETS)
+
+    def start(self, msg):
+        size = _size(msg.get('payload')) if isinstance(msg, dict) else None
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            if size is not None:
+                self.payload_size.observe(size)
+
+    def end(self, t0, error=None):
+        dt = time.perf_counter() - t0
+        with self.lock:
+            self.in_flight -= 1
+            if isinstance(error, Busy):
+                self.calls -= 1
+                self.rejected += 1
+            elif isinstance(error, UnknownNodeConfig):
+                self.calls -= 1  # sent again by the Node-RED node with its configuration
+            elif isinstance(error, DeadlineExceeded):
+                self.expired += 1  # skipped or cancelled, the time is not the processing time of the node
+            else:
+                self.latency.observe(dt)
+                if error is not None and not isinstance(error, NodeWaiting):
+                    self.errors += 1
+
+
+def _size(payload):
+    if isinstance(payload, (str, bytes, bytearray, list, dict)):
+        return len(payload)
+    return None
+
+
+nodes = dict()  # node name -> NodeMetrics
+collectors = list()  # functions returning lines of metrics, called for each scrape
+
+
+def instrument(f, name):
+    """wrap a method of the JSON-RPC dispatcher to count the calls, errors, and measure latency and payload size of the messages"""
+
+    metrics = nodes.setdefault(name, NodeMetrics(name))
+
+    def applicator(*args, **kwargs):
+        msg = kwargs.get('msg')
+        if msg is None:
+            return f(*args, **kwargs)  # registration or close of a Node-RED node
+
+        metrics.start(msg)
+        t0 = time.perf_counter()
+        try:
+            result = f(*args, **kwargs)
+        except Exception as e:
+            metrics.end(t0, e)
+            raise
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: metrics.end(t0, future.exception()))
+        elif inspect.isgenerator(result):
+            return _measure_iteration(result, metrics, t0)
+        else:
+            metrics.end(t0)
+        return result
+
+    applicator.__doc__ = f.__doc__
+    return applicator
+
+
+def _measure_iteration(results, metrics, t0):
+    # the msgs of a generator node are produced while the response is sent
+    error = None
+    try:
+        yield from results
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        metrics.end(t0, error)
+
+
+def _family(name, type, help):
+    return ["# HELP %s %s" % (name, help), "# TYPE %s %s" % (name, type)]
+
+
+def render():
+    """return the metrics in the Prometheus text format. The lines of a metric (HELP, TYPE and the samples of all the nodes)
+    must be grouped together."""
+
+    families = [
+        ("pynodered_calls_total", "counter", "Number of messages processed by the node."),
+        ("pynodered_errors_total", "counter", "Number of messages that raised an exception."),
+        ("pynodered_rejected_total", "counter", "Number of messages rejected because the node was busy."),
+        ("pynodered_expired_total", "counter",
+         "Number of messages skipped or cancelled because the Node-RED node stopped waiting for the result."),
+        ("pynodered_in_flight", "gauge", "Number of messages being processed."),
+        ("pynodered_latency_seconds", "histogram", "Time to process a message in the server."),
+        ("pynodered_payload_size", "histogram", "Length of msg.payload (str, bytes, list and dict only)."),
+    ]
+    samples = {name: _family(name, type, help) for name, type, help in families}
+    for name, m in sorted(nodes.items()):
+        labels = 'node="%s"' % name
+        with m.lock:
+            samples["pynodered_calls_total"].append('pynodered_calls_total{%s} %d' % (labels, m.calls))
+            samples["pynodered_errors_total"].append('pynodered_errors_total{%s} %d' % (labels, m.errors))
+            samples["pynodered_rejected_total"].append('pynodered_rejected_total{%s} %d' % (labels, m.rejected))
+            samples["pynodered_expired_total"].append('pynodered_expired_total{%s} %d' % (labels, m.expired))
+            samples["pynodered_in_flight"].append('pynodered_in_flight{%s} %d' % (labels, m.in_flight))
+            samples["pynodered_latency_seconds"].extend(m.latency.lines("pynodered_latency_seconds", labels))
+            samples["pynodered_payload_size"].extend(m.payload_size.lines("pynodered_payload_size", labels))
+
+    lines = [line for name, type, help in families for line in samples[name]]
+    for collector in collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+
+def node_collector(classes, admissions, process_nodes=()):
+    """return a collector of the state of the nodes: calls waiting in the server (admissions is a dict name -> Admission),
+    incomplete groups of messages of the Join and cache hits of the node classes. The Join and cache of the process_nodes (names of
+    the nodes run in worker processes) are in the workers and are not collected."""
+
+    def collect():
+        local = [cls for cls in classes if cls.name not in process_nodes]
+        yield from _family("pynodered_admitted", "gauge", "Number of messages running or waiting for their turn in the server.")
+        for name, admission in sorted(admissions.items()):
+            yield 'pynodered_admitted{node="%s"} %d' % (name, admission.admitted)
+
+        joins = [(cls.name, cls.join) for cls in local if getattr(cls, "join", None) is not None]
+        yield from _family("pynodered_join_pending", "gauge", "Number of incomplete groups of messages waiting in the Join of the node.")
+        for name, join in joins:
+            yield 'pynodered_join_pending{node="%s"} %d' % (name, join.pending())
+        yield from _family("pynodered_join_dropped_total", "counter", "Number of incomplete groups dropped by the Join of the node.")
+        for name, join in joins:
+            yield 'pynodered_join_dropped_total{node="%s"} %d' % (name, join.dropped)
+
+        caches = [(cls.name, cls.cache) for cls in local if getattr(cls, "cache", None) is not None]
+        yield from _family("pynodered_cache_hits_total", "counter", "Number of messages answered from the cache of the node.")
+        for name, cache in caches:
+            yield 'pynodered_cache_hits_total{node="%s"} %d' % (name, cache.hits)
+        yield from _family("pynodered_cache_misses_total", "counter", "Number of messages not found in the cache of the node.")
+        for name, cache in caches:
+            yield 'pynodered_cache_misses_total{node="%s"} %d' % (name, cache.misses)
+
+    return collect
@@ -0,0 +1,82 @@
+"""Deterministic profiling (cProfile) of the work function of selected nodes. The statistics accumulate per node while the profiling
+is active and can be downloaded in the pstats format (readable with pstats, snakeviz or flameprof to draw flame graphs).
+When a node is not profiled, the cost is a dictionary lookup per call.
+
+The profiling is started with the --profile option of the server or with the /profile/<name> endpoint (see server.py).
+"""
+
+import cProfile
+import io
+import marshal
+import pstats
+import sys
+import threading
+
+profiles = dict()  # node name -> NodeProfile
+_process_lock = threading.Lock()  # since Python 3.12 (sys.monitoring), only one profiler can be enabled at a time in the process
+
+
+class NodeProfile(object):
+    """the statistics of a node, accumulated in one profiler enabled during each call. The profiled calls run one at a time, those of
+    all the profiled nodes since Python 3.12."""
+
+    def __init__(self, name):
+        self.name = name
+        self.active = True
+        self.calls = 0
+        self.skipped = 0  # calls not profiled because a profiler not started by pynodered was active
+        self.profile = cProfile.Profile()
+        self.lock = _process_lock if sys.version_info >= (3, 12) else threading.Lock()
+
+    def run(self, f, *args):
+        with self.lock:
+            try:
+                self.profile.enable()
+            except ValueError:
+                self.skipped += 1
+                return f(*args)
+            try:
+                return f(*args)
+            finally:
+                self.profile.disable()
+                self.calls += 1
+
+    @property
+    def stats(self):
+        # must be called with the lock
+        return pstats.Stats(self.profile) if self.calls else None
+
+    def dump(self):
+        """return the statistics in the binary format of pstats (as written by pstats.Stats.dump_stats)"""
+        with self.lock:
+            stats = self.stats
+            return marshal.dumps(stats.stats if stats is not None else {})
+
+    def text(self, sort="cumulative", limit=50):
+        """return the statistics as text"""
+        stream = io.StringIO()
+        with self.lock:
+            stats = self.stats
+            if stats is None:
+                return "no call profiled\n"
+            stats.stream = stream
+            stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+
+def get_profile(name):
+    """return the active NodeProfile of the node or None. This is called for each message."""
+    profile = profiles.get(name)
+    return profile if profile is not None and profile.active else None
+
+
+def start(name):
+    """start profiling a node, the previous statistics are discarded"""
+    profiles[name] = NodeProfile(name)
+
+
+def stop(name):
+    """stop profiling a node, the statistics are kept"""
+    profile = profiles.get(name)
+    if profile is not None:
+        profile.active = False
@@ -7,33 +7,423 @@ import inspect
 import pprint
 import json
 import copy
+import logging
+import signal
+import threading
+import time
+import os
+import subprocess
+import urllib.parse
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from flask import Flask
-from flask import Blueprint, jsonify
+from flask import Blueprint, jsonify, request, Response
 
 from jsonrpc.backend.flask import api
+from jsonrpc.exceptions import JSONRPCDispatchException, JSONRPCInvalidRequestException, JSONRPCParseError, JSONRPCInvalidRequest, \
+    JSONRPCServerError
+from jsonrpc.jsonrpc import JSONRPCRequest
+from jsonrpc.jsonrpc2 import JSONRPC20Response, JSONRPC20BatchRequest, JSONRPC20BatchResponse
+from jsonrpc.manager import JSONRPCResponseManager
 # https://media.readthedocs.org/pdf/json-rpc/latest/json-rpc.pdf
 
-from pynodered.core import silent_node_waiting
+from pynodered.core import silent_node_waiting, NodeWaiting, NodeRegistry, UnknownNodeConfig, Busy, DeadlineExceeded, InstallManifest, \
+    endpoint_options, package_options as package_options_tpl
+from pynodered.workers import ProcessPool
+from pynodered.codec import get_codec, codecs, codecs_by_name
+from pynodered import metrics, profiling, store, state
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
 
 app = Flask(__name__)
-app.register_blueprint(api.as_blueprint())
+logger = logging.getLogger(__name__)
+blocking_methods = set()  # the nodes whose calls block the thread until the result is computed
+profiled_methods = set()  # the nodes which can be profiled: the functions run in the threads of the server
+batch_threads = 8  # the threads running the calls to the blocking nodes sent in the same batch, set by main() from --threads
+_batch_executor = None
+_batch_executor_lock = threading.Lock()
+
+
+def get_batch_executor():
+    """return the executor running the calls of a batch to the blocking nodes, created at the first batch with batch_threads threads"""
+    global _batch_executor
+    with _batch_executor_lock:
+        if _batch_executor is None:
+            _batch_executor = ThreadPoolExecutor(max_workers=batch_threads, thread_name_prefix="batch")
+        return _batch_executor
+
+
+@app.route('/', methods=['POST'])
+def jsonrpc():
+    """JSON-RPC endpoint. The requests and responses are encoded with the codec given by the Content-Type header."""
+
+    codec = get_codec(request.content_type)
+    if codec is None:
+        return Response("unsupported content type %s" % request.content_type, status=415)
+
+    try:
+        data = codec.loads(request.get_data())
+    except Exception:
+        response = JSONRPC20Response(error=JSONRPCParseError()._data)
+    else:
+        try:
+            rpc_request = JSONRPCRequest.from_data(data)
+        except (TypeError, ValueError, JSONRPCInvalidRequestException):
+            response = JSONRPC20Response(error=JSONRPCInvalidRequest()._data)
+        else:
+            response = handle_request(rpc_request)
+            if response:
+                wait_results(response)
+
+    return Response(codec.dumps(response.data) if response else b"", content_type=codec.content_type)
+
+
+def handle_request(rpc_request):
+    """dispatch a JSON-RPC request. The calls of a batch to blocking nodes run in parallel in the batch executor, as they would if they
+    were sent in separate requests. The other calls return at once (a Future or a generator) and are waited for in wait_results."""
+
+    if not isinstance(rpc_request, JSONRPC20BatchRequest):
+        return JSONRPCResponseManager.handle_request(rpc_request, api.dispatcher)
+    blocking = [r for r in rpc_request.requests if r.method in blocking_methods]
+    if len(blocking) < 2:
+        return JSONRPCResponseManager.handle_request(rpc_request, api.dispatcher)
+
+    executor = get_batch_executor()
+    futures = {id(r): executor.submit(JSONRPCResponseManager.handle_request, r, api.dispatcher) for r in blocking}
+    results = {id(r): JSONRPCResponseManager.handle_request(r, api.dispatcher) for r in rpc_request.requests if id(r) not in futures}
+    for key, future in futures.items():
+        results[key] = future.result()
+    responses = [results[id(r)] for r in rpc_request.requests if results[id(r)] is not None]  # None for the notifications
+    if not responses:
+        return None
+    response = JSONRPC20BatchResponse(*responses)
+    response.request = rpc_request
+    return response
+
+
+def wait_results(response):
+    """replace the futures returned by the coroutine nodes in the response by their results. The calls of a batch run
+    concurrently because they are all started before waiting for any of them."""
+
+    for r in (response.responses if isinstance(response, JSONRPC20BatchResponse) else [response]):
+        future = r.result
+        if inspect.isgenerator(future):
+            # a generator node called without streaming, the msgs are sent all at once
+            future = Future()
+            try:
+                future.set_result(list(r.result))
+            except Exception as e:
+                future.set_exception(e)
+        if not isinstance(future, Future):
+            continue
+        try:
+            r.data = {"id": r._id, "result": future.result()}
+        except NodeWaiting:
+            r.data = {"id": r._id, "result": None}
+        except DeadlineExceeded:
+            r.data = {"id": r._id, "error": deadline_exceeded().error._data}
+        except JSONRPCDispatchException as e:
+            r.data = {"id": r._id, "error": e.error._data}
+        except Exception as e:
+            r.data = {"id": r._id, "error": server_error(e)}
+
+
+@app.route('/stream/<name>', methods=['POST'])
+def stream(name):
+    """streaming endpoint of the generator nodes. The body holds the parameters of the JSON-RPC method of the node and the msgs yielded
+    by the node are sent as they come, in frames of the codec: {"result": msg} for each msg or {"error": error}."""
+
+    codec = get_codec(request.content_type)
+    if codec is None:
+        return Response("unsupported content type %s" % request.content_type, status=415)
+    if name not in api.dispatcher:
+        return Response("unknown node %s" % name, status=404)
+
+    try:
+        results = api.dispatcher[name](**codec.loads(request.get_data()))
+    except JSONRPCDispatchException as e:
+        frames = [{"error": e.error._data}]
+    except Exception as e:
+        frames = [{"error": server_error(e)}]
+    else:
+        frames = stream_frames(results)
+
+    return Response((codec.frame(frame) for frame in frames), content_type=codec.content_type)
+
+
+def stream_frames(results):
+    """return the frames of the msgs yielded by a generator node"""
+
+    try:
+        for result in results or ():
+            yield {"result": result}
+    except NodeWaiting:
+        pass
+    except DeadlineExceeded:
+        yield {"error": deadline_exceeded().error._data}
+    except Exception as e:
+        yield {"error": server_error(e)}
+
+
+def server_error(e):
+    data = {"type": e.__class__.__name__, "args": e.args, "message": str(e)}
+    logger.exception("API Exception: {0}".format(data))
+    return JSONRPCServerError(data=data)._data
+
+
+app.add_url_rule('/map', view_func=api.jsonrpc_map, methods=['GET'])
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    """health check, used by the nodes to find out when a server which has refused a connection is back"""
+    return jsonify({"status": "ok", "pid": os.getpid()})
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4")
+
+
+@app.route('/profile', methods=['GET'])
+def profile_list():
+    """list the profiled nodes"""
+    return jsonify({name: {"active": p.active, "calls": p.calls, "skipped": p.skipped} for name, p in profiling.profiles.items()})
+
+
+@app.route('/profile/<name>', methods=['GET', 'POST', 'DELETE'])
+def profile(name):
+    """POST starts profiling the node, DELETE stops it and GET downloads the statistics: in the pstats format
+    (save it in a file and open it with pstats.Stats) or as text with ?format=text&sort=tottime&limit=20"""
+
+    if name not in api.dispatcher:
+        return Response("unknown node %s" % name, status=404)
+    if request.method == 'POST':
+        if name not in profiled_methods:
+            return Response("the node %s cannot be profiled, only the functions run in the threads of the server can (not the "
+                            "coroutines, generators, batch functions and worker processes)\n" % name, status=409)
+        profiling.start(name)
+        return Response("profiling %s\n" % name)
+    if request.method == 'DELETE':
+        profiling.stop(name)
+        return Response("stopped profiling %s\n" % name)
+
+    p = profiling.profiles.get(name)
+    if p is None:
+        return Response("node %s is not profiled" % name, status=404)
+    if request.args.get('format') == 'text':
+        text = p.text(request.args.get('sort', 'cumulative'), int(request.args.get('limit', 50)))
+        return Response(text, content_type="text/plain")
+    return Response(p.dump(), content_type="application/octet-stream",
+                    headers={"Content-Disposition": "attachment; filename=%s.pstats" % name})
+
+
+# JSON-RPC error code telling the Node-RED node to send its configuration again
+UNKNOWN_NODE_CONFIG = -32001
+# JSON-RPC error code telling the Node-RED node that the Python node is overloaded
+BUSY = -32002
+# JSON-RPC error code of the calls abandoned because the Node-RED node stopped waiting for the result
+DEADLINE_EXCEEDED = -32003
+
+
+def deadline_exceeded():
+    return JSONRPCDispatchException(code=DEADLINE_EXCEEDED, message="deadline exceeded")
+
+
+def rpc_errors(f):
+    """translate the pynodered exceptions into JSON-RPC errors"""
+    def applicator(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        except UnknownNodeConfig as e:
+            raise JSONRPCDispatchException(code=UNKNOWN_NODE_CONFIG, message="unknown node configuration %s" % e)
+        except Busy:
+            raise JSONRPCDispatchException(code=BUSY, message="busy")
+        except DeadlineExceeded:
+            raise deadline_exceeded()
+
+    return applicator
+
+
+def add_node_method(f, cls, process=False):
+    """register the method of a node in the JSON-RPC dispatcher. process tells that f runs the node in a worker process"""
+    sync = not (cls.is_async or cls.is_generator or cls.batch is not None)
+    for methods, included in ((blocking_methods, process or sync), (profiled_methods, sync and not process)):
+        if included:
+            methods.add(cls.name)
+        else:
+            methods.discard(cls.name)  # reloaded
+    if cls.store:
+        f = store.keeping(f)
+    api.dispatcher.add_method(rpc_errors(metrics.instrument(f, cls.name)), cls.name)
 
 
 def node_directory(package_name):
     return Path.home() / ".node-red" / "node_modules" / package_name  # assume this also work on MacOS and Windows...
 
 
+def load_module(path, reload=False):
+    """import a python file or a module by name. Return None for the private files (starting with '_').
+    With reload, the file is executed again in a new module even if it has already been imported."""
+
+    if path.endswith(".py"):
+        path = Path(path)
+        if path.stem.startswith("_"):
+            return None
+        # import a file
+        module_name = "pynodered.imported_modules." + path.stem
+        if module_name in sys.modules and not reload:
+            return sys.modules[module_name]  # already imported (e.g. inherited by a forked worker)
+        spec = importlib.util.spec_from_file_location(module_name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules[module_name] = module
+    else:
+        # import a module
+        module = importlib.import_module(path)
+    return module
+
+
+def find_nodes(module):
+    """return the (name, class) pairs of the nodes defined in the module"""
+
+    return [(name, obj) for name, obj in inspect.getmembers(module, inspect.isclass)
+            if hasattr(obj, "install") and hasattr(obj, "work") and hasattr(obj, "run") and hasattr(obj, "name")]
+
+
+def close_when_idle(registry, timeout=60):
+    """close the nodes of a registry replaced by a reload once the calls in progress have completed"""
+
+    def close():
+        deadline = time.time() + timeout
+        while registry.admission.admitted > 0 and time.time() < deadline:
+            time.sleep(0.1)
+        registry.close_all()
+    threading.Thread(target=close, daemon=True).start()
+
+
+def watch(paths, interval, callback):
+    """call callback(path) in a background thread when the modification time of one of the files changes"""
+
+    def mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    def poll():
+        mtimes = {path: mtime(path) for path in paths}
+        while True:
+            time.sleep(interval)
+            for path in paths:
+                t = mtime(path)
+                if t is not None and t != mtimes[path]:
+                    mtimes[path] = t
+                    callback(path)
+    threading.Thread(target=poll, daemon=True).start()
+
+
+def load_shards(path):
+    """read the shard map: a JSON file mapping package or node names to the lists of the endpoints of the servers running them"""
+
+    with open(path) as f:
+        shards = json.load(f)
+    if not isinstance(shards, dict) or not all(isinstance(endpoints, list) and endpoints for endpoints in shards.values()):
+        raise Exception("the shard map %s must map package or node names to lists of endpoints" % path)
+    for endpoints in shards.values():
+        for endpoint in endpoints:
+            endpoint_options(endpoint)  # check the endpoint
+    return shards
+
+
+def launch_shards(shards, args):
+    """start a server process for each endpoint of the shard map on this host, except this server. Return the processes."""
+
+    own = "unix:" + os.path.abspath(args.socket) if args.socket else "http://localhost:%s" % args.port
+    local = set()
+    for endpoint in sorted(set(sum(shards.values(), []))):
+        if endpoint.startswith("unix:"):
+            endpoint = "unix:" + os.path.abspath(endpoint[len("unix:"):])
+        else:
+            url = urllib.parse.urlsplit(endpoint)
+            if url.hostname not in ("localhost", "127.0.0.1"):
+                continue  # the servers of the other hosts are started there
+            endpoint = "http://localhost:%s" % url.port
+        if endpoint != own:
+            local.add(endpoint)
+
+    processes = list()
+    for endpoint in sorted(local):
+        command = [sys.executable, "-m", "pynodered.server", "--noinstall", "--server", args.server, "--threads", str(args.threads),
+                   "--backlog", str(args.backlog), "--store-size", str(args.store_size), "--store-ttl", str(args.store_ttl)]
+        if args.workers is not None:
+            command += ["--workers", str(args.workers)]
+        if args.watch:
+            command += ["--watch", str(args.watch)]
+        if args.state_db:
+            command += ["--state-db", args.state_db]
+        if endpoint.startswith("unix:"):
+            command += ["--socket", endpoint[len("unix:"):]]
+        else:
+            command += ["--port", endpoint.rsplit(":", 1)[1]]
+        print("Launch the server of %s" % endpoint)
+        processes.append(subprocess.Popen(command + args.filenames))
+    return processes
+
+
 def main():
     parser = argparse.ArgumentParser(prog='pynodered')
     parser.add_argument('--noinstall', action="store_true",
-                        help="do not install javascript files to save startup time. It is only necessary to install the files once or whenever a python function change")
+                        help="do not install javascript files. The files of the nodes that have not changed since the last installation are not rewritten anyway")
     parser.add_argument('--port',
                         help="port to use by Flask to run the Python server handling the request from Node-RED",
                         default=5051)
+    parser.add_argument('--socket', default=None, metavar="PATH",
+                        help="listen on this Unix domain socket instead of the port. The nodes are installed to connect to it. "
+                             "This saves the TCP stack when Node-RED and pynodered run on the same host")
+    parser.add_argument('--host', default='127.0.0.1',
+                        help="address to listen on. Use 0.0.0.0 for the servers of a shard map running on other hosts than Node-RED")
+    parser.add_argument('--shards', default=None, metavar="FILE",
+                        help="JSON file mapping package or node names to lists of endpoints (http://host:port or unix:/path of a socket) "
+                             "of the servers running them. The nodes are installed to share their requests among these servers")
+    parser.add_argument('--launch', action="store_true",
+                        help="start the servers of the endpoints of the shard map on this host, with the same python files")
+    parser.add_argument('--server', choices=['auto', 'waitress', 'flask'], default='auto',
+                        help="HTTP server to use. 'waitress' is a production server with a thread pool and keep-alive connections, "
+                             "'flask' is the Flask development server. 'auto' uses waitress if it is installed")
+    parser.add_argument('--threads', type=int, default=8,
+                        help="number of threads handling the requests concurrently")
+    parser.add_argument('--backlog', type=int, default=1024,
+                        help="maximum number of pending connections in the listen queue")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="number of worker processes running the nodes declared with executor='process'. "
+                             "Default is the number of CPUs, 0 runs these nodes in the server process")
+    parser.add_argument('--profile', default="",
+                        help="comma-separated names of the nodes to profile from the start. The profiling can also be started "
+                             "and stopped with POST and DELETE on /profile/<name>, and the statistics downloaded with GET")
+    parser.add_argument('--watch', type=float, nargs='?', const=1, default=None, metavar="INTERVAL",
+                        help="reload the python files when they change, checking every INTERVAL seconds (default 1). "
+                             "The nodes of the other files are not affected")
+    parser.add_argument('--store-size', type=int, default=1000,
+                        help="maximum number of payloads kept in the server for the nodes declared with store=True")
+    parser.add_argument('--store-ttl', type=float, default=600,
+                        help="time in seconds after which the payloads kept in the server expire")
+    parser.add_argument('--state-db', default=None, metavar="PATH",
+                        help="keep the incomplete groups of the joins in this SQLite database instead of the memory of the process. "
+                             "The database is shared by the worker processes and the servers of the host")
     parser.add_argument('filenames', help='list of python file names or module names', nargs='+')
     args = parser.parse_args(sys.argv[1:])
 
+    global batch_threads
+    batch_threads = args.threads
+    store.payloads = store.PayloadStore(args.store_size, args.store_ttl)
+    if args.state_db:
+        state.default = state.SQLiteState(args.state_db)
+    shards = load_shards(args.shards) if args.shards else {}
+
     # register files:
     packages = dict()
 
@@ -48,26 +438,30 @@ def main():
         }
     }
 
+    options = dict()
+    manifests = dict()
+
     registered = 0
+    process_nodes = list()
+    registries = dict()  # node name -> NodeRegistry of the nodes run in the server process
+    classes = list()
+    admissions = dict()
+    file_nodes = dict()  # path -> names of the nodes defined in the file
+
+    def node_options(obj, package_name):
+        # the endpoints of the node in the shard map, by name or by package
+        endpoints = shards.get(obj.name) or shards.get(package_name)
+        if endpoints is None:
+            return options[package_name]
+        return dict(options[package_name], endpoints=endpoints)
 
     for path in args.filenames:
 
         print("Path: ", path)
 
-        # import the module by file or by name
-        if path.endswith(".py"):
-            path = Path(path)
-            if path.stem.startswith("_"):
-                continue
-            # import a file
-            module_name = "pynodered.imported_modules." + path.stem
-            spec = importlib.util.spec_from_file_location(module_name, path)
-            module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(module)
-            sys.modules[module_name] = module
-        else:
-            # import a module
-            module = importlib.import_module(path)
+        module = load_module(path)
+        if module is None:
+            continue
 
         # prepare the package json file
         if hasattr(module, "package"):
@@ -77,39 +471,139 @@ def main():
             package_name = module.package['name']
             if package_name not in packages:
                 packages[package_name] = copy.deepcopy(package_tpl)  # load default values
-                packages[package_name].update(module.package)  # update them with module.package
+                options[package_name] = dict(package_options_tpl)
+                for k, v in module.package.items():  # update them with module.package
+                    if k in package_options_tpl:
+                        options[package_name][k] = v
+                    else:
+                        packages[package_name][k] = v
+                if options[package_name]['codec'] not in codecs_by_name:
+                    raise Exception("the codec of the package %s must be one of %s" % (package_name, ", ".join(codecs_by_name)))
+                if codecs_by_name[options[package_name]['codec']] not in codecs.values():
+                    raise Exception("the codec %s is not available. Check that the python package is installed" % options[package_name]['codec'])
+                if options[package_name]['balance'] not in ("least_outstanding", "round_robin"):
+                    raise Exception("the balance of the package %s must be 'least_outstanding' or 'round_robin'" % package_name)
         else:
             package_name = 'pynodered'  # default name
             if package_name not in packages:
                 packages[package_name] = copy.deepcopy(package_tpl)  # load default values
+                options[package_name] = dict(package_options_tpl)
+
+        options[package_name]['socket'] = os.path.abspath(args.socket) if args.socket else None  # not a package option
 
         node_dir = node_directory(package_name)
+        if package_name not in manifests:
+            manifests[package_name] = InstallManifest(node_dir)
 
         # now look for the functions and classes
 
-        for name, obj in inspect.getmembers(module, inspect.isclass):
-            if hasattr(obj, "install") and hasattr(obj, "work") and hasattr(obj, "run") and hasattr(obj, "name"):
-                print(f"From {name} register {obj.name}")
-                if not args.noinstall:
-                    obj.install(node_dir, args.port)
+        file_nodes[path] = list()
+        for name, obj in find_nodes(module):
+            print(f"From {name} register {obj.name}")
+            classes.append(obj)
+            file_nodes[path].append(obj.name)
+            if not args.noinstall:
+                if obj.install(node_dir, args.port, node_options(obj, package_name), manifests[package_name]):
                     print("Install %s" % name)
-                    packages[package_name]["node-red"]["nodes"][obj.name] = obj.name + '.js'
+                packages[package_name]["node-red"]["nodes"][obj.name] = obj.name + '.js'
 
-                inst = obj()
-                api.dispatcher.add_method(silent_node_waiting(inst.run), obj.name)
-                registered += 1
+            if obj.executor == "process" and args.workers != 0:
+                process_nodes.append(obj)  # registered once all the modules are imported
+            else:
+                registries[obj.name] = NodeRegistry(obj)
+                admissions[obj.name] = registries[obj.name].admission
+                add_node_method(silent_node_waiting(registries[obj.name].run), obj)
+            registered += 1
 
-                # obj can run an http_server if it has one
-                if hasattr(obj, "http_server"):
-                    obj.http_server(app)
+            # obj can run an http_server if it has one
+            if hasattr(obj, "http_server"):
+                obj.http_server(app)
 
     if registered == 0:
         raise Exception("Zero function or class to register to Node-RED has been found. Check your python files")
 
+    for name in shards:
+        if name not in packages and name not in (obj.name for obj in classes):
+            print("The shard map refers to %s, which is neither a package nor a node" % name)
+
+    metrics.collectors.append(metrics.node_collector(classes, admissions, {obj.name for obj in process_nodes}))
+
+    for name in filter(None, args.profile.split(",")):
+        if name not in (obj.name for obj in classes):
+            raise Exception("cannot profile the node %s, it is not defined in the python files" % name)
+        if name not in profiled_methods:
+            raise Exception("cannot profile the node %s, only the functions run in the threads of the server can be profiled" % name)
+        profiling.start(name)
+
+    pool = ProcessPool(args.filenames, args.workers, args.state_db) if process_nodes else None
+    for obj in process_nodes:
+        method = pool.method(obj)
+        admissions[obj.name] = method.admission
+        add_node_method(method, obj, process=True)
+
     if not args.noinstall:
         for package_name in packages:
-            with open(node_directory(package_name) / "package.json", "w") as f:
-                json.dump(packages[package_name], f)
+            if options[package_name]['codec'] == 'msgpack':
+                packages[package_name]["dependencies"]["@msgpack/msgpack"] = "^2.8.0"
+            manifests[package_name].write_package(packages[package_name])
+            manifests[package_name].save()
+
+    def reload(path):
+        # the nodes of the file are replaced in the dispatcher, the calls in progress complete with the former nodes
+        print("Reload %s" % path)
+        try:
+            module = load_module(path, reload=True)
+        except Exception:
+            logger.exception("cannot reload %s, the nodes are unchanged" % path)
+            return
+        if module is None:
+            return
+        package = getattr(module, "package", {'name': 'pynodered'})
+        package_name = package.get('name') if isinstance(package, dict) else None
+        if package_name not in packages:
+            print("The package of %s has changed, restart the server" % path)
+            return
+
+        names = list()
+        for name, obj in find_nodes(module):
+            names.append(obj.name)
+            if obj.name not in registries:
+                if obj.name in admissions:
+                    print("%s runs in the worker processes, restart the server to reload it" % obj.name)
+                    continue
+                print("%s is a new node, restart Node-RED to use it" % obj.name)
+            if not args.noinstall:
+                if obj.install(node_directory(package_name), args.port, node_options(obj, package_name), manifests[package_name]):
+                    print("Install %s" % name)
+                packages[package_name]["node-red"]["nodes"][obj.name] = obj.name + '.js'
+
+            registry = NodeRegistry(obj)
+            former = registries.get(obj.name)
+            registries[obj.name] = registry
+            admissions[obj.name] = registry.admission
+            classes[:] = [cls for cls in classes if cls.name != obj.name] + [obj]
+            add_node_method(silent_node_waiting(registry.run), obj)
+            if former is not None:
+                close_when_idle(former)
+
+        for name in set(file_nodes[path]) - set(names):
+            if name not in registries:
+                continue
+            print("Remove %s" % name)
+            del api.dispatcher[name]
+            close_when_idle(registries.pop(name))
+            admissions.pop(name)
+            classes[:] = [cls for cls in classes if cls.name != name]
+            packages[package_name]["node-red"]["nodes"].pop(name, None)
+            manifests[package_name].remove(name)
+        file_nodes[path] = names
+
+        if not args.noinstall:
+            manifests[package_name].write_package(packages[package_name])
+            manifests[package_name].save()
+
+    if args.watch:
+        watch([path for path in args.filenames if path.endswith(".py")], args.watch, reload)
 
     # print('ROUTES')
     # for rule in app.url_map.iter_rules():
@@ -117,7 +611,50 @@ def main():
     #     # and rules that require parameters
     #     print(rule.methods,rule.endpoint)
 
-    app.run(host='127.0.0.1', port=args.port)  # , debug=True)
+    shard_servers = launch_shards(shards, args) if args.launch else []
+
+    try:
+        serve(args)
+    finally:
+        for process in shard_servers:
+            process.terminate()
+        for registry in registries.values():
+            registry.close_all()
+        if pool is not None:
+            pool.shutdown()
+        for process in shard_servers:
+            process.wait()
+
+
+def _terminate(signum, frame):
+    # SystemExit lets the servers finish the running requests and close the sockets
+    sys.exit(0)
+
+
+def serve(args):
+    """run the server selected by the command line arguments until it is interrupted (Ctrl-C or SIGTERM)."""
+
+    signal.signal(signal.SIGTERM, _terminate)
+
+    server = args.server
+    if server == 'auto':
+        server = 'waitress' if waitress is not None else 'flask'
+
+    if server == 'waitress':
+        if waitress is None:
+            raise Exception("waitress is not installed. Install it with 'pip install waitress' or use '--server flask'")
+        if args.socket:
+            waitress.serve(app, unix_socket=args.socket, unix_socket_perms='600', threads=args.threads, backlog=args.backlog)
+        else:
+            waitress.serve(app, host=args.host, port=args.port, threads=args.threads, backlog=args.backlog)
+    else:
+        from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+        BaseWSGIServer.request_queue_size = args.backlog
+        WSGIRequestHandler.protocol_version = "HTTP/1.1"  # keep the connections alive
+        if args.socket:
+            app.run(host='unix://' + os.path.abspath(args.socket), threaded=args.threads > 1)
+        else:
+            app.run(host=args.host, port=args.port, threaded=args.threads > 1)  # , debug=True)
 
 
 if __name__ == '__main__':
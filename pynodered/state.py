@@ -0,0 +1,198 @@
+"""Backends of the state shared by the calls of a node, for now the incomplete groups of messages of the Join. The default backend keeps
+them in the memory of the process. The SQLite backend keeps them in a database in WAL mode, shared by all the processes of the host
+(worker processes, servers of a shard map), so that the messages of a group can be received by different processes:
+
+    $ pynodered --state-db /tmp/pynodered.db mynodes.py
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from pynodered.ttldict import TTLDict
+
+
+class MemoryState(object):
+    """the default backend, the groups are kept in the memory of the process"""
+
+    def groups(self, namespace, size, ttl=None, max_pending=None, on_drop=None):
+        """return the groups of size values of a node (namespace). The incomplete groups are dropped after ttl seconds without new
+        value and beyond max_pending groups, and passed to on_drop(key, values)."""
+        return MemoryGroups(size, ttl, max_pending, on_drop)
+
+
+class MemoryGroups(object):
+
+    def __init__(self, size, ttl=None, max_pending=None, on_drop=None):
+        self.size = size
+        self.complete = (1 << size) - 1  # bitmask of a complete group
+        self.max_pending = max_pending
+        self.on_drop = on_drop
+        self.mem = TTLDict(ttl, on_expire=self._drop)  # key -> [bitmask of the values set, values]
+        self.lock = threading.RLock()
+
+    def push(self, key, index, value):
+        """set the value at index in the group of key and return the values of the group if it is complete (the group is then
+        removed), None otherwise"""
+
+        with self.lock:
+            group = self.mem.get(key)
+            if group is None:
+                group = [0, [None] * self.size]
+                if self.max_pending is not None:
+                    while len(self.mem) >= self.max_pending:
+                        self._drop(*self.mem.popitem(last=False))
+            else:
+                del self.mem[key]  # inserted again below as the most recently updated
+
+            group[0] |= 1 << index
+            group[1][index] = value
+            if group[0] == self.complete:
+                return group[1]
+            self.mem[key] = group
+        return None
+
+    def _drop(self, key, group):
+        if self.on_drop is not None:
+            self.on_drop(key, group[1])
+
+    def pending(self):
+        """return the number of incomplete groups"""
+        with self.lock:
+            return len(self.mem)
+
+    def discard(self, key):
+        """forget the group of key"""
+        with self.lock:
+            self.mem.pop(key, None)
+
+
+class SQLiteState(object):
+    """the groups are kept in a SQLite database in WAL mode at path, shared by the processes of the host. Each push is a transaction
+which sets the value and checks if the group is complete atomically. The values are pickled."""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS groups (namespace TEXT, key TEXT, mask INTEGER, updated REAL, PRIMARY KEY (namespace, key));
+        CREATE INDEX IF NOT EXISTS groups_updated ON groups (namespace, updated);
+        CREATE TABLE IF NOT EXISTS group_values (namespace TEXT, key TEXT, position INTEGER, value BLOB,
+                                                 PRIMARY KEY (namespace, key, position));
+    """
+
+    def __init__(self, path, timeout=30):
+        self.path = str(path)
+        self.timeout = timeout
+        self.local = threading.local()  # one connection per thread
+        conn = self.connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(self.SCHEMA)
+
+    def connection(self):
+        # the connections are not shared with the forked processes
+        conn, pid = getattr(self.local, "conn", (None, None))
+        if conn is None or pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")  # durable enough in WAL mode, the groups are transient
+            self.local.conn = conn, os.getpid()
+        return conn
+
+    def groups(self, namespace, size, ttl=None, max_pending=None, on_drop=None):
+        return SQLiteGroups(self, namespace, size, ttl, max_pending, on_drop)
+
+
+class SQLiteGroups(object):
+
+    def __init__(self, state, namespace, size, ttl=None, max_pending=None, on_drop=None):
+        self.state = state
+        self.namespace = namespace
+        self.size = size
+        self.complete = (1 << size) - 1
+        self.ttl = ttl
+        self.max_pending = max_pending
+        self.on_drop = on_drop
+        self.next_purge = 0
+
+    def push(self, key, index, value):
+        conn = self.state.connection()
+        now = time.time()
+        dropped = []
+        conn.execute("BEGIN IMMEDIATE")  # locks the database for writing until the end of the transaction
+        try:
+            row = conn.execute("SELECT mask, updated FROM groups WHERE namespace = ? AND key = ?", (self.namespace, key)).fetchone()
+            if row is not None and self.ttl is not None and row[1] < now - self.ttl:
+                dropped += self._take(conn, [key]).items()  # expired but not purged yet
+                row = None
+            mask = (row[0] if row is not None else 0) | (1 << index)
+            if mask == self.complete:
+                values = self._take(conn, [key])[key]
+                values[index] = value
+            else:
+                values = None
+                if row is None:
+                    if self.ttl is not None and now >= self.next_purge:
+                        dropped += self._expired(conn, now)
+                        self.next_purge = now + min(self.ttl, 1)
+                    if self.max_pending is not None:
+                        dropped += self._oldest(conn)
+                    conn.execute("INSERT INTO groups VALUES (?, ?, ?, ?)", (self.namespace, key, mask, now))
+                else:
+                    conn.execute("UPDATE groups SET mask = ?, updated = ? WHERE namespace = ? AND key = ?",
+                                 (mask, now, self.namespace, key))
+                conn.execute("INSERT OR REPLACE INTO group_values VALUES (?, ?, ?, ?)",
+                             (self.namespace, key, index, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+        if self.on_drop is not None:
+            for key_values in dropped:
+                self.on_drop(*key_values)
+        return values
+
+    def _take(self, conn, keys):
+        # remove the groups and return their values
+        groups = {key: [None] * self.size for key in keys}
+        for key in keys:
+            for position, value in conn.execute("SELECT position, value FROM group_values WHERE namespace = ? AND key = ?",
+                                                (self.namespace, key)):
+                groups[key][position] = pickle.loads(value)
+            conn.execute("DELETE FROM group_values WHERE namespace = ? AND key = ?", (self.namespace, key))
+            conn.execute("DELETE FROM groups WHERE namespace = ? AND key = ?", (self.namespace, key))
+        return groups
+
+    def _expired(self, conn, now):
+        keys = [key for key, in conn.execute("SELECT key FROM groups WHERE namespace = ? AND updated < ?",
+                                             (self.namespace, now - self.ttl))]
+        return list(self._take(conn, keys).items())
+
+    def _oldest(self, conn):
+        # the least recently updated groups beyond max_pending - 1, to make room for a new group
+        count, = conn.execute("SELECT COUNT(*) FROM groups WHERE namespace = ?", (self.namespace,)).fetchone()
+        if count < self.max_pending:
+            return []
+        keys = [key for key, in conn.execute("SELECT key FROM groups WHERE namespace = ? ORDER BY updated LIMIT ?",
+                                             (self.namespace, count - self.max_pending + 1))]
+        return list(self._take(conn, keys).items())
+
+    def pending(self):
+        if self.ttl is not None:
+            count, = self.state.connection().execute("SELECT COUNT(*) FROM groups WHERE namespace = ? AND updated >= ?",
+                                                     (self.namespace, time.time() - self.ttl)).fetchone()
+        else:
+            count, = self.state.connection().execute("SELECT COUNT(*) FROM groups WHERE namespace = ?", (self.namespace,)).fetchone()
+        return count
+
+    def discard(self, key):
+        conn = self.state.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._take(conn, [key])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+default = MemoryState()  # the backend of the nodes which do not set one, replaced by the --state-db option of the server
@@ -0,0 +1,97 @@
+"""Store of the payloads of the nodes declared with node_red(store=True). The payloads of their results stay in the server and the
+msgs sent to Node-RED carry a handle instead, so that large objects (NumPy arrays, DataFrames, ...) passed between Python nodes are not
+serialized. The handles are resolved before the work function of the next Python node. The materialize node of
+pynodered.materialize replaces the handle by the payload for the other Node-RED nodes.
+"""
+
+import inspect
+import uuid
+from concurrent.futures import Future
+
+from pynodered.ttldict import TTLDict
+
+HANDLE_TYPE = "pynodered.Handle"
+
+
+class PayloadStore(object):
+    """a bounded store of payloads. The least recently used payloads are evicted beyond maxsize and the payloads expire after ttl
+seconds (None: never).
+"""
+
+    def __init__(self, maxsize=1000, ttl=600):
+        self.mem = TTLDict(ttl, maxsize=maxsize)
+
+    def keep(self, payload):
+        """keep the payload and return its handle"""
+        key = uuid.uuid4().hex
+        self.mem[key] = payload
+        return {"type": HANDLE_TYPE, "id": key, "summary": summary(payload)}
+
+    def get(self, handle):
+        try:
+            payload = self.mem[handle["id"]]
+            self.mem.move_to_end(handle["id"])
+        except KeyError:
+            raise Exception("the payload %s is no longer in the store. Increase the size or the ttl of the store" % handle["id"])
+        return payload
+
+
+payloads = PayloadStore()
+
+
+def summary(payload):
+    # a description of the payload for the users of Node-RED
+    shape = getattr(payload, "shape", None)
+    if shape is not None:
+        return "%s %s" % (type(payload).__name__, tuple(shape))
+    try:
+        return "%s of length %i" % (type(payload).__name__, len(payload))
+    except TypeError:
+        return type(payload).__name__
+
+
+def is_handle(value):
+    return isinstance(value, dict) and value.get("type") == HANDLE_TYPE and "id" in value
+
+
+def resolve(msg):
+    """return the msg with its payload if it carries a handle, the msg itself otherwise"""
+    if isinstance(msg, dict) and is_handle(msg.get('payload')):
+        msg = dict(msg)
+        msg['payload'] = payloads.get(msg['payload'])
+    return msg
+
+
+def keep(result):
+    """replace the payloads of the results of a node (a msg, a list of msgs, a Future or a generator of msgs) by handles"""
+
+    if isinstance(result, dict):
+        if result.get('payload') is not None and not is_handle(result['payload']):
+            result = dict(result)
+            result['payload'] = payloads.keep(result['payload'])
+        return result
+    if isinstance(result, list):
+        return [keep(r) for r in result]
+    if isinstance(result, Future):
+        kept = Future()
+
+        def done(future):
+            try:
+                kept.set_result(keep(future.result()))
+            except BaseException as e:
+                kept.set_exception(e)
+        result.add_done_callback(done)
+        return kept
+    if inspect.isgenerator(result):
+        return (keep(r) for r in result)
+    return result
+
+
+def keeping(f):
+    """wrap the method of a node to keep the payloads of its results in the store"""
+
+    def applicator(*args, **kwargs):
+        return keep(f(*args, **kwargs))
+
+    applicator.__doc__ = f.__doc__
+    return applicator
@@ -26,29 +26,51 @@
 # ACTION OF CONTRACT, NEGLIGENCE OR OTHER TORTIOUS ACTION, ARISING OUT OF
 # OR IN CONNECTION WITH THE USE OR PERFORMANCE OF THIS SOFTWARE.
 
-# Modified by Ghislain to remove the orderdict
+# Modified by Ghislain to expire the keys with a heap of expiration times instead of scanning all the keys
 
-from threading import RLock
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from heapq import heappush, heappop, heapify
+from itertools import count
+from threading import RLock, Thread, Event
 import time
 
 __all__ = ['TTLDict']
 
 
-class TTLDict(dict):
+class TTLDict(MutableMapping):
     """
     Dict with TTL
     Extra args and kwargs are passed to initial .update() call
+
+    The expiration times are kept in a heap, so that removing the expired
+    keys costs O(log n) per key instead of a scan of all the keys. The
+    reads do not take the lock. The expired keys are removed by the
+    calls to len(), keys(), items(), values() and purge(), or by a
+    background thread started with reaper_interval (in seconds).
+    With maxsize, setting a new key in a full dict removes the first
+    inserted key (the least recently used if move_to_end is called on
+    each use).
     """
-    def __init__(self, default_ttl, *args, **kwargs):
+    def __init__(self, default_ttl, *args, on_expire=None, reaper_interval=None, maxsize=None, **kwargs):
         """
         Be warned, if you use this with Python versions earlier than 3.6
         when passing **kwargs order is not preseverd.
+        on_expire(key, value) is called for the keys removed because
+        they have expired. default_ttl None means no expiration.
         """
-        assert isinstance(default_ttl, int)
+        assert default_ttl is None or isinstance(default_ttl, (int, float))
         self._default_ttl = default_ttl
+        self._maxsize = maxsize
+        self._on_expire = on_expire
         self._lock = RLock()
-        super().__init__()
+        self._data = OrderedDict()  # key -> (expire, value), its move_to_end is atomic for the lock-free reads
+        self._heap = []  # (expire, seq, key), possibly outdated if the key has been set again
+        self._seq = count()
+        self._reaper = None
         self.update(*args, **kwargs)
+        if reaper_interval is not None:
+            self.start_reaper(reaper_interval)
 
     def __repr__(self):
         return '<TTLDict@%#08x; ttl=%r, Dict=%r;>' % (
@@ -57,7 +79,25 @@ class TTLDict(dict):
     def __len__(self):
         with self._lock:
             self._purge()
-            return super().__len__()
+            return len(self._data)
+
+    def _set(self, key, expire, value):
+        # must be called with the lock
+        if self._maxsize is not None and key not in self._data and len(self._data) >= self._maxsize:
+            self._purge()
+            if len(self._data) >= self._maxsize:
+                del self._data[next(iter(self._data))]
+        self._data[key] = (expire, value)
+        if expire is not None:
+            heappush(self._heap, (expire, next(self._seq), key))
+            if len(self._heap) > 2 * len(self._data) + 64:
+                self._compact()
+
+    def _compact(self):
+        # drop the outdated entries of the heap
+        self._heap = [(expire, seq, key) for expire, seq, key in self._heap
+                      if self._data.get(key, (None,))[0] == expire]
+        heapify(self._heap)
 
     def set_ttl(self, key, ttl, now=None):
         """Set TTL for the given key"""
@@ -65,87 +105,151 @@ class TTLDict(dict):
             now = time.time()
         with self._lock:
             value = self[key]
-            super().__setitem__(key, (now + ttl, value))
+            self._set(key, now + ttl, value)
 
     def get_ttl(self, key, now=None):
         """Return remaining TTL for a key"""
         if now is None:
             now = time.time()
-        with self._lock:
-            expire, _value = super().__getitem__(key)
-            return expire - now
+        expire, _value = self._data[key]
+        return expire - now
 
     def expire_at(self, key, timestamp):
         """Set the key expire timestamp"""
         with self._lock:
-            value = self.__getitem__(key)
-            super().__setitem__(key,  (timestamp, value))
+            value = self[key]
+            self._set(key, timestamp, value)
 
     def is_expired(self, key, now=None):
         """ Check if key has expired, and return it if so"""
-        with self._lock:
-            if now is None:
-                now = time.time()
+        if now is None:
+            now = time.time()
+
+        expire, _value = self._data[key]
 
-            expire, _value = super().__getitem__(key)
+        if expire is not None and expire < now:
+            return key
 
-            if expire:
-                if expire < now:
-                    return key
+    def purge(self, now=None):
+        """Remove the expired keys"""
+        with self._lock:
+            self._purge(now)
 
-    def _purge(self):
-        _keys = list(super().__iter__())
-        _remove = [key for key in _keys if self.is_expired(key)]  # noqa
-        [self.__delitem__(key) for key in _remove]
+    def _purge(self, now=None):
+        if now is None:
+            now = time.time()
+        heap = self._heap
+        while heap and heap[0][0] < now:
+            expire, _seq, key = heappop(heap)
+            item = self._data.get(key)
+            if item is not None and item[0] == expire:
+                del self._data[key]
+                if self._on_expire is not None:
+                    self._on_expire(key, item[1])
 
     def __iter__(self):
         """
         Yield only non expired keys, without purging the expired ones
         """
+        now = time.time()
         with self._lock:
-            for key in super().__iter__():
-                if not self.is_expired(key):
-                    yield key
+            items = list(self._data.items())
+        for key, (expire, _value) in items:
+            if expire is None or expire >= now:
+                yield key
+
+    def __contains__(self, key):
+        item = self._data.get(key)
+        return item is not None and (item[0] is None or item[0] >= time.time())
 
     def __setitem__(self, key, value):
+        if self._default_ttl is None:
+            expire = None
+        else:
+            expire = time.time() + self._default_ttl
         with self._lock:
-            if self._default_ttl is None:
-                expire = None
-            else:
-                expire = time.time() + self._default_ttl
-            super().__setitem__(key,  (expire, value))
+            self._set(key, expire, value)
 
     def __delitem__(self, key):
         with self._lock:
-            super().__delitem__(key)
+            del self._data[key]
 
     def __getitem__(self, key):
-        with self._lock:
-            if self.is_expired(key):
-                self.__delitem__(key)
-                raise KeyError
-            item = super().__getitem__(key)[1]
-            return item
+        expire, value = self._data[key]
+        if expire is not None and expire < time.time():
+            with self._lock:
+                self._purge()
+            raise KeyError(key)
+        return value
 
     def keys(self):
         with self._lock:
             self._purge()
-            return super().keys()
+            return list(self._data.keys())
 
     def items(self):
         with self._lock:
             self._purge()
-            _items = list(super(Dict, self).items())
-            return [(k, v[1]) for (k, v) in _items]
+            return [(k, v[1]) for (k, v) in self._data.items()]
 
     def values(self):
         with self._lock:
             self._purge()
-            _values = list(super(Dict, self).values())
-            return [v[1] for v in _values]
+            return [v[1] for v in self._data.values()]
+
+    def pop(self, key, *default):
+        with self._lock:
+            try:
+                value = self[key]
+            except KeyError:
+                if default:
+                    return default[0]
+                raise
+            del self._data[key]
+            return value
+
+    def popitem(self, last=True):
+        """Remove and return the last inserted (key, value) pair, or the first if last is False"""
+        with self._lock:
+            self._purge()
+            if not self._data:
+                raise KeyError('popitem(): dictionary is empty')
+            key = next(reversed(self._data)) if last else next(iter(self._data))
+            return key, self._data.pop(key)[1]
+
+    def move_to_end(self, key):
+        """Move the key at the end of the insertion order, so that it is the last removed by maxsize"""
+        with self._lock:
+            self._data.move_to_end(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._heap = []
 
     def get(self, key, default=None):
         try:
             return self[key]
         except KeyError:
             return default
+
+    def start_reaper(self, interval):
+        """Start a daemon thread removing the expired keys every interval seconds"""
+        if self._reaper is not None:
+            return
+        stop = Event()
+
+        def reap():
+            while not stop.wait(interval):
+                self.purge()
+
+        self._reaper = (Thread(target=reap, name="TTLDict reaper", daemon=True), stop)
+        self._reaper[0].start()
+
+    def stop_reaper(self):
+        """Stop the thread started by start_reaper"""
+        if self._reaper is not None:
+            thread, stop = self._reaper
+            stop.set()
+            thread.join()
+            self._reaper = None
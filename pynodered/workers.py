@@ -0,0 +1,122 @@
+"""Pool of worker processes to run the CPU-bound nodes, those declared with node_red(executor="process"), outside of the server process
+and escape the GIL. Each worker imports the user modules once at startup and keeps the nodes registered by the Node-RED nodes.
+"""
+
+import os
+import inspect
+import threading
+from concurrent.futures import ProcessPoolExecutor, Future
+
+from pynodered.core import NodeWaiting, NodeRegistry, Admission, Deadline, NO_DEADLINE, UnknownNodeConfig, config_etag
+from pynodered import store, state
+
+_nodes = dict()  # node registries in the worker process
+
+
+def _initialize(filenames, state_db=None):
+    from pynodered.server import load_module, find_nodes
+
+    if state_db:
+        state.default = state.SQLiteState(state_db)  # for the workers which are not forked
+
+    for path in filenames:
+        module = load_module(path)
+        if module is None:
+            continue
+        for name, obj in find_nodes(module):
+            if obj.executor == "process":
+                _nodes[obj.name] = NodeRegistry(obj)
+
+
+def _run(name, kwargs):
+    # not decorated with silent_node_waiting, the function must be picklable by name
+    try:
+        result = _nodes[name].run(**kwargs)
+        if inspect.isgenerator(result):
+            return list(result)  # the msgs of a generator node are sent back all at once
+        return result.result() if isinstance(result, Future) else result
+    except NodeWaiting:
+        return None
+
+
+def _ping(i):
+    return os.getpid()
+
+
+class ProcessPool(object):
+    """a pool of pre-forked worker processes. The method(cls) returns a function that can be registered in the JSON-RPC dispatcher
+in place of the run method of the node. Each worker has its own executor: the msgs go to the least busy worker, and the
+registrations and closes of the Node-RED nodes go to all the workers since each one keeps its own instances of the nodes.
+"""
+
+    def __init__(self, filenames, workers=None, state_db=None):
+        self.workers = workers or os.cpu_count()
+        self.executors = [ProcessPoolExecutor(max_workers=1, initializer=_initialize, initargs=(list(filenames), state_db))
+                          for i in range(self.workers)]
+        self.pending = [0] * self.workers  # calls submitted to each worker and not completed yet
+        self.lock = threading.Lock()
+        # start all the workers now rather than on the first messages
+        pids = set(executor.submit(_ping, i).result() for i, executor in enumerate(self.executors))
+        print("Started %i worker processes" % len(pids))
+
+    def submit(self, *args):
+        """submit a call to the worker with the fewest pending calls"""
+        with self.lock:
+            i = min(range(self.workers), key=self.pending.__getitem__)
+            self.pending[i] += 1
+        future = self.executors[i].submit(*args)
+        future.add_done_callback(lambda future: self._done(i))
+        return future
+
+    def _done(self, i):
+        with self.lock:
+            self.pending[i] -= 1
+
+    def broadcast(self, *args):
+        """submit a call to all the workers and return their results"""
+        futures = [executor.submit(*args) for executor in self.executors]
+        return [future.result() for future in futures]
+
+    def method(self, cls):
+        admission = Admission(cls.concurrency, cls.max_queue)
+        configs = dict()  # node id -> (etag, config), to register the Node-RED nodes in the workers which do not know them yet
+        lock = threading.Lock()
+
+        def remember(kwargs):
+            config = kwargs.get('config')
+            node_id = kwargs.get('node_id') or (config or {}).get('id')
+            with lock:
+                if kwargs.get('close'):
+                    if kwargs.get('etag') is None or configs.get(node_id, (None,))[0] == kwargs.get('etag'):
+                        configs.pop(node_id, None)
+                elif config is not None:
+                    configs[node_id] = (kwargs.get('etag') or config_etag(config), config)
+
+        def run(**kwargs):
+            remember(kwargs)
+            if 'msg' not in kwargs:
+                self.broadcast(_run, cls.name, kwargs)  # registration or close
+                return None
+            kwargs['msg'] = store.resolve(kwargs['msg'])  # the payloads kept in the store of the server process
+            deadline = Deadline(kwargs['timeout'] / 1000) if kwargs.get('timeout') else NO_DEADLINE
+
+            def submit():
+                if deadline.at is not None:
+                    kwargs['timeout'] = deadline.remaining() * 1000  # the time left once the concurrency allows the call
+                try:
+                    return self.submit(_run, cls.name, kwargs).result()
+                except UnknownNodeConfig:
+                    # the configuration was registered in another worker, no need to ask the Node-RED node again
+                    with lock:
+                        etag, config = configs.get(kwargs.get('node_id'), (None, None))
+                    if config is None or (kwargs.get('etag') is not None and kwargs['etag'] != etag):
+                        raise
+                    return self.submit(_run, cls.name, dict(kwargs, etag=etag, config=config)).result()
+            return admission.run(submit, deadline=deadline)
+        run.__doc__ = "run the node %s in a worker process" % cls.name
+        run.admission = admission
+        return run
+
+    def shutdown(self):
+        for executor in self.executors:
+            executor.shutdown(wait=True)
@@ -14,6 +14,10 @@ with open('README.rst', encoding = 'UTF-8') as readme_file:
 
 requirements = [ 'flask', 'json-rpc']
 
+extras_requirements = {'production': ['waitress'],
+                       'msgpack': ['msgpack'],
+                       'orjson': ['orjson']}
+
 setup_requirements = ['pytest-runner', ]
 
 test_requirements = ['pytest', ]
@@ -33,6 +37,7 @@ setup(
     ],
     description="make python function easily accessible from Node-RED ",
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="GNU General Public License v3",
     long_description=readme, #+ '\n\n' + history,
     include_package_data=True,
@@ -49,6 +54,7 @@ setup(
     entry_points={
         'console_scripts': [
             'pynodered=pynodered.server:main',
+            'pynodered-bench=pynodered.bench:main',
         ],
     },
 )
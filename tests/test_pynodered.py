@@ -3,6 +3,8 @@
 
 """Tests for `pynodered` package."""
 
+import asyncio
+
 import pytest
 
 
@@ -23,3 +25,365 @@ def test_content(response):
     """Sample pytest test function with the pytest fixture as an argument."""
     # from bs4 import BeautifulSoup
     # assert 'GitHub' in BeautifulSoup(response.content).title.string
+
+
+@pynodered.node_red(properties=dict(number=pynodered.NodeProperty("Number", value="1")))
+def repeat(node, msg):
+    msg['payload'] = msg['payload'] * int(node.number.value)
+    return msg
+
+
+def test_configure_does_not_modify_the_class():
+    node = repeat().configure({'number': "3"})
+    assert node.number.value == "3"
+    assert repeat.number.value == "1"
+    assert node.work({'payload': "a"})['payload'] == "aaa"
+
+
+def test_registry():
+    registry = pynodered.core.NodeRegistry(repeat)
+    assert registry.run(node_id="n1", etag="e1", config={'number': "2"}) is None
+    assert registry.run({'payload': "a"}, node_id="n1", etag="e1")['payload'] == "aa"
+
+    with pytest.raises(pynodered.core.UnknownNodeConfig):
+        registry.run({'payload': "a"}, node_id="n1", etag="e2")
+    with pytest.raises(pynodered.core.UnknownNodeConfig):
+        registry.run({'payload': "a"}, node_id="n2")
+
+    assert registry.run({'payload': "a"}, node_id="n1", etag="e2", config={'number': "4"})['payload'] == "aaaa"
+
+
+class CountingNode(pynodered.core.RNBaseNode):
+    started = []
+    closed = []
+
+    def on_start(self):
+        self.started.append(self.config['id'])
+
+    def on_close(self):
+        self.closed.append(self.config['id'])
+
+
+@pynodered.node_red(baseclass=CountingNode)
+def counting(node, msg):
+    return node
+
+
+def test_registry_instances():
+    registry = pynodered.core.NodeRegistry(counting, maxsize=2)
+    for node_id in ["a", "b"]:
+        registry.run(config={'id': node_id})
+    assert CountingNode.started == []  # created on the first message
+
+    a = registry.run({}, node_id="a")
+    assert registry.run({}, node_id="a") is a
+    assert registry.run({}, node_id="b") is not a
+    assert CountingNode.started == ["a", "b"]
+
+    registry.run({}, config={'id': "c"})  # "a" is the least recently used
+    assert CountingNode.closed == ["a"]
+    registry.run(node_id="b", close=True)
+    assert CountingNode.closed == ["a", "b"]
+    registry.close_all()
+    assert CountingNode.closed == ["a", "b", "c"]
+
+
+def test_join():
+    dropped = []
+    join = pynodered.core.Join(["a", "b"], max_pending=2, on_drop=lambda msgid, payloads: dropped.append(msgid))
+
+    with pytest.raises(pynodered.core.NodeWaiting):
+        join({'_msgid': "m1", 'topic': "b", 'payload': 2})
+    assert join({'_msgid': "m1", 'topic': "a", 'payload': 1}) == [1, 2]
+    assert join.pending() == 0
+
+    for msgid in ["m2", "m3", "m4"]:
+        join.push({'_msgid': msgid, 'topic': "a", 'payload': 0})
+    assert dropped == ["m2"]
+    assert join.pending() == 2
+
+
+@pynodered.node_red(concurrency=2)
+async def async_upper(node, msg):
+    msg['payload'] = msg['payload'].upper()
+    return msg
+
+
+def test_async_node():
+    registry = pynodered.core.NodeRegistry(async_upper)
+    future = registry.run({'payload': "a"}, config={'id': "n1"})
+    assert future.result(timeout=5)['payload'] == "A"
+
+
+def test_admission():
+    admission = pynodered.core.Admission(concurrency=1, max_queue=1)
+    admission.admit()
+    admission.admit()
+    with pytest.raises(pynodered.core.Busy):
+        admission.admit()
+    assert admission.rejected == 1
+    admission.release()
+    assert admission.run(lambda x: x + 1, 1) == 2
+
+    with pytest.raises(ValueError):
+        pynodered.node_red(max_queue=5)(lambda node, msg: msg)  # unbounded without concurrency
+
+
+def test_profiling():
+    registry = pynodered.core.NodeRegistry(repeat)
+    pynodered.profiling.start(repeat.name)
+    try:
+        registry.run({'payload': "a"}, config={'id': "n1", 'number': "2"})
+        profile = pynodered.profiling.profiles[repeat.name]
+        assert profile.calls == 1
+        assert "repeat" in profile.text()
+    finally:
+        pynodered.profiling.stop(repeat.name)
+    registry.run({'payload': "a"}, node_id="n1")
+    assert profile.calls == 1
+
+
+def test_bench_percentile():
+    from pynodered.bench import percentile
+    values = list(range(101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) is None
+
+
+def test_bench_nodes():
+    from pynodered import bench, bench_nodes, server
+    # the nodes of the scenarios are installed with the package
+    assert set(bench.scenarios) <= {obj.name for name, obj in server.find_nodes(bench_nodes)}
+
+
+def test_install_manifest(tmp_path):
+    manifest = pynodered.core.InstallManifest(tmp_path)
+    assert repeat.install(tmp_path, 5051, {}, manifest)
+    assert counting.install(tmp_path, 5051, {}, manifest)
+    manifest.save()
+    assert manifest.write_package({"name": "test"})
+    assert not manifest.write_package({"name": "test"})
+
+    manifest = pynodered.core.InstallManifest(tmp_path)
+    assert not repeat.install(tmp_path, 5051, {}, manifest)
+    assert repeat.install(tmp_path, 5051, {'batch_size': 10}, manifest)
+    manifest.save()  # counting is no longer installed
+    assert (tmp_path / "repeat.js").exists()
+    assert not (tmp_path / "counting.js").exists()
+
+
+calls = []
+
+
+@pynodered.node_red(cache=dict(maxsize=2))
+def cached_upper(node, msg):
+    calls.append(msg['payload'])
+    msg['payload'] = msg['payload'].upper()
+    return msg
+
+
+def test_cache():
+    registry = pynodered.core.NodeRegistry(cached_upper)
+    registry.run(config={'id': "n1"})
+    assert registry.run({'_msgid': "1", 'payload': "a"}, node_id="n1") == {'_msgid': "1", 'payload': "A"}
+    assert registry.run({'_msgid': "2", 'payload': "a"}, node_id="n1") == {'_msgid': "2", 'payload': "A"}
+    assert calls == ["a"]
+    registry.run({'payload': "b"}, node_id="n1")
+    registry.run({'payload': "a"}, node_id="n1")
+    registry.run({'payload': "c"}, node_id="n1")  # evicts b, the least recently used
+    registry.run({'payload': "b"}, node_id="n1")
+    assert calls == ["a", "b", "c", "b"]
+    assert (cached_upper.cache.hits, cached_upper.cache.misses) == (2, 4)
+
+
+@pynodered.node_red(cache=dict())
+def mark_seen(node, msg):
+    msg['payload']['seen'] = True
+    return msg
+
+
+def test_cache_nested_change():
+    registry = pynodered.core.NodeRegistry(mark_seen)
+    registry.run(config={'id': "n1"})
+    assert registry.run({'_msgid': "1", 'payload': {'a': 1}}, node_id="n1") == {'_msgid': "1", 'payload': {'a': 1, 'seen': True}}
+    assert registry.run({'_msgid': "2", 'payload': {'a': 1}}, node_id="n1") == {'_msgid': "2", 'payload': {'a': 1, 'seen': True}}
+    assert mark_seen.cache.hits == 1
+
+
+@pynodered.node_red(cache=dict(), outputs=2)
+def first_output(node, msg):
+    return msg, None
+
+
+def test_cache_outputs():
+    registry = pynodered.core.NodeRegistry(first_output)
+    registry.run(config={'id': "n1"})
+    assert registry.run({'payload': "a"}, node_id="n1") == ({'payload': "a"}, None)
+    assert registry.run({'payload': "a"}, node_id="n1") == ({'payload': "a"}, None)
+    assert first_output.cache.hits == 1
+
+
+@pynodered.node_red(concurrency=1, max_queue=0)
+def count_to(node, msg):
+    for i in range(msg['payload']):
+        yield {'payload': i}
+
+
+def test_generator_node():
+    registry = pynodered.core.NodeRegistry(count_to)
+    results = registry.run({'payload': 3}, config={'id': "n1"})
+    assert next(results) == {'payload': 0}
+    with pytest.raises(pynodered.core.Busy):
+        registry.run({'payload': 3}, node_id="n1")  # the first call is still running
+    assert list(results) == [{'payload': 1}, {'payload': 2}]
+    assert registry.admission.admitted == 0
+
+
+batches = []
+
+
+@pynodered.node_red(batch=dict(max_size=3, max_wait_ms=20))
+def double(node, msgs):
+    batches.append(len(msgs))
+    return [{'payload': msg['payload'] * 2} for msg in msgs]
+
+
+def test_batch_node():
+    registry = pynodered.core.NodeRegistry(double)
+    registry.run(config={'id': "n1"})
+    futures = [registry.run({'payload': i}, node_id="n1") for i in range(4)]
+    assert [f.result(timeout=5)['payload'] for f in futures] == [0, 2, 4, 6]
+    assert batches == [3, 1]  # a full batch and a batch run after max_wait_ms
+    assert registry.admission.admitted == 0
+
+
+def test_store():
+    handle = pynodered.store.keep({'_msgid': "1", 'payload': [1, 2, 3]})['payload']
+    assert pynodered.store.is_handle(handle)
+    registry = pynodered.core.NodeRegistry(repeat)
+    msg = registry.run({'payload': handle}, config={'id': "n1", 'number': "2"})
+    assert msg['payload'] == [1, 2, 3, 1, 2, 3]
+    with pytest.raises(Exception):
+        pynodered.store.resolve({'payload': dict(handle, id="expired")})
+
+
+@pynodered.node_red(outputs=2)
+def check_length(node, msg):
+    msg['selected_output'] = 0 if len(msg['payload']) < 4 else 1
+    return msg
+
+
+short_repeat = pynodered.node_red_pipeline(check_length, repeat, name="short_repeat")
+
+
+def test_pipeline():
+    registry = pynodered.core.NodeRegistry(short_repeat)
+    assert [p.name for p in short_repeat.properties] == ["number"]
+    assert short_repeat.outputs == 2
+    registry.run(config={'id': "n1", 'number': "3"})
+    assert registry.run({'payload': "ab"}, node_id="n1") == {'payload': "ababab"}
+    assert registry.run({'payload': "abcd"}, node_id="n1") == {'payload': "abcd", 'selected_output': 1}
+
+
+@pynodered.node_red()
+async def slow_upper(node, msg):
+    await asyncio.sleep(msg['payload'])
+    return {'payload': pynodered.get_deadline().remaining() > 0}
+
+
+def test_deadline():
+    admission = pynodered.core.Admission(concurrency=1, max_queue=1)
+    expired = pynodered.core.Deadline(-1)
+    with pytest.raises(pynodered.DeadlineExceeded):
+        admission.run(lambda x: x + 1, 1, deadline=expired)  # skipped
+    assert admission.admitted == 0
+    assert admission.run(lambda: pynodered.get_deadline().remaining(), deadline=pynodered.core.Deadline(10)) > 9
+
+    # a call waiting for its turn gives up at its deadline
+    import threading
+    release = threading.Event()
+    running = threading.Thread(target=admission.run, args=(release.wait, 5))
+    running.start()
+    while admission.admitted == 0:
+        pass
+    deadline = pynodered.core.Deadline(0.05)
+    with pytest.raises(pynodered.DeadlineExceeded):
+        admission.run(lambda: None, deadline=deadline)
+    assert deadline.remaining() > -1  # without waiting for the running call
+    release.set()
+    running.join()
+    assert admission.admitted == 0
+
+    registry = pynodered.core.NodeRegistry(slow_upper)
+    registry.run(config={'id': "n1"})
+    assert registry.run({'payload': 0}, node_id="n1", timeout=1000).result(timeout=5) == {'payload': True}
+    with pytest.raises(pynodered.DeadlineExceeded):
+        registry.run({'payload': 10}, node_id="n1", timeout=50).result(timeout=5)  # cancelled
+    assert registry.admission.admitted == 0
+
+
+def test_endpoints(tmp_path):
+    assert pynodered.core.endpoint_options("unix:/tmp/s.sock") == {"url": "http://localhost/", "socketPath": "/tmp/s.sock"}
+    with pytest.raises(Exception):
+        pynodered.core.endpoint_options("localhost:5051")
+    repeat.install(tmp_path, 5051, {"endpoints": ["http://h1:5051", "http://h2:5051"]})
+    assert '{"url": "http://h2:5051/", "socketPath": ""}' in (tmp_path / "repeat.js").read_text()
+
+
+def test_request_batch_size():
+    assert repeat.request_batch_size(pynodered.core.package_options) == 1
+    assert async_upper.request_batch_size(pynodered.core.package_options) == pynodered.core.ASYNC_BATCH_SIZE
+    assert async_upper.request_batch_size(dict(pynodered.core.package_options, batch_size=1)) == 1
+
+
+def test_join_sqlite(tmp_path):
+    dropped = []
+    # two processes sharing the database
+    join1 = pynodered.core.Join(["a", "b"], max_pending=2, on_drop=lambda msgid, payloads: dropped.append((msgid, payloads)),
+                                state=pynodered.state.SQLiteState(tmp_path / "state.db"))
+    join2 = pynodered.core.Join(["a", "b"], state=pynodered.state.SQLiteState(tmp_path / "state.db"))
+    join1.name = join2.name = "node"
+    assert join1.push({'_msgid': "m1", 'topic': "b", 'payload': {'x': 2}}) is None
+    assert join2.push({'_msgid': "m1", 'topic': "a", 'payload': 1}) == [1, {'x': 2}]
+    assert join1.pending() == 0
+
+    for msgid in ["m2", "m3", "m4"]:
+        join1.push({'_msgid': msgid, 'topic': "a", 'payload': 0})
+    assert dropped == [("m2", [0, None])]
+    assert join2.pending() == 2
+    join2.clean({'_msgid': "m3"})
+    assert join1.pending() == 1
+
+
+PROCESS_MODULE = '''
+import os
+from pynodered import node_red
+
+@node_red(executor="process")
+def process_pid(node, msg):
+    msg['payload'] = os.getpid()
+    return msg
+'''
+
+
+def test_process_executor(tmp_path):
+    import os
+    from pynodered import server, workers
+
+    path = tmp_path / "process_module.py"
+    path.write_text(PROCESS_MODULE)
+    cls = dict(server.find_nodes(server.load_module(str(path))))["process_pid"]
+    pool = workers.ProcessPool([str(path)], workers=2)
+    try:
+        run = pool.method(cls)
+        run(config={'id': "n1"})  # registered in all the workers
+        pids = {run(msg={'payload': None}, node_id="n1")['payload'] for i in range(10)}
+        assert pids and os.getpid() not in pids
+        run(msg={'payload': None}, config={'id': "n2"})  # registered with the first msg only
+        assert all(run(msg={'payload': None}, node_id="n2")['payload'] for i in range(10))
+        run(node_id="n1", close=True)
+        with pytest.raises(pynodered.core.UnknownNodeConfig):
+            run(msg={'payload': None}, node_id="n1")
+    finally:
+        pool.shutdown()
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `pynodered.server`."""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import pytest
+
+import pynodered
+from pynodered import server, codec, metrics
+from pynodered.core import NodeRegistry, silent_node_waiting
+
+
+@pynodered.node_red(name="server_echo")
+def server_echo(node, msg):
+    return msg
+
+
+@pynodered.node_red(name="server_sleep")
+def server_sleep(node, msg):
+    time.sleep(0.2)
+    return msg
+
+
+batches = []
+
+
+@pynodered.node_red(name="server_batch", batch=dict(max_size=16, max_wait_ms=2000))
+def server_batch(node, msgs):
+    batches.append(len(msgs))
+    return msgs
+
+
+server.add_node_method(silent_node_waiting(NodeRegistry(server_echo).run), server_echo)
+server.add_node_method(silent_node_waiting(NodeRegistry(server_batch).run), server_batch)
+server.add_node_method(silent_node_waiting(NodeRegistry(server_sleep).run), server_sleep)
+
+
+@pytest.fixture
+def client():
+    return server.app.test_client()
+
+
+def call(client, codec, params):
+    request = {"jsonrpc": "2.0", "method": "server_echo", "params": params, "id": "1"}
+    response = client.post("/", data=codec.dumps(request), content_type=codec.content_type)
+    assert response.status_code == 200 and response.content_type == codec.content_type
+    return codec.loads(response.data)
+
+
+def test_json_codec(client):
+    response = call(client, codec.JSONCodec, {"msg": {"payload": b"\x00\x01"}, "config": {"id": "n1"}})
+    assert response["result"] == {"payload": {"type": "Buffer", "data": [0, 1]}}  # as a Node-RED Buffer in JSON
+
+
+def test_msgpack_codec(client):
+    pytest.importorskip("msgpack")
+    response = call(client, codec.MsgpackCodec, {"msg": {"payload": b"\x00\x01"}, "config": {"id": "n1"}})
+    assert response["result"] == {"payload": b"\x00\x01"}
+
+
+def test_unsupported_codec(client):
+    assert client.post("/", data=b"", content_type="text/plain").status_code == 415
+
+
+def test_metrics(client):
+    call(client, codec.JSONCodec, {"msg": {"payload": "a"}, "config": {"id": "n1"}})
+    text = client.get("/metrics").data.decode()
+
+    # all the lines of a metric must be grouped: HELP, TYPE and the samples
+    families = []
+    types = {}
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            name, type = line.split()[2:]
+            types[name] = type
+        elif line.startswith("#"):
+            name = line.split()[2]
+        else:
+            name = line.split("{")[0].split()[0]
+            for suffix in ("_bucket", "_sum", "_count"):
+                if name.endswith(suffix) and types.get(name[:-len(suffix)]) == "histogram":
+                    name = name[:-len(suffix)]
+            assert name in types  # a sample after the TYPE of its metric
+        if not families or families[-1] != name:
+            families.append(name)
+    assert len(families) == len(set(families))
+
+    assert types["pynodered_latency_seconds"] == "histogram"
+    assert 'pynodered_calls_total{node="server_echo"} ' in text
+
+
+def test_batch(client):
+    # the calls of a batch to a sync node run in parallel and the responses keep the order of the calls
+    requests = [{"jsonrpc": "2.0", "method": "server_sleep", "params": {"msg": {"payload": i}, "config": {"id": "n1"}}, "id": i}
+                for i in range(4)]
+    t0 = time.perf_counter()
+    response = client.post("/", data=codec.JSONCodec.dumps(requests), content_type=codec.JSONCodec.content_type)
+    assert time.perf_counter() - t0 < 0.6
+    assert [r["result"] for r in codec.JSONCodec.loads(response.data)] == [{"payload": i} for i in range(4)]
+
+
+def test_batch_node(client):
+    # the batch is full (and runs at once) when 16 calls wait in the server at the same time
+    def request(params):
+        return {"jsonrpc": "2.0", "method": "server_batch", "params": params, "id": str(params["msg"]["payload"])}
+
+    def post(data):
+        response = server.app.test_client().post("/", data=codec.JSONCodec.dumps(data), content_type=codec.JSONCodec.content_type)
+        return codec.JSONCodec.loads(response.data)
+
+    post({"jsonrpc": "2.0", "method": "server_batch", "params": {"config": {"id": "n1"}}, "id": "0"})
+    t0 = time.perf_counter()
+    clients = [threading.Thread(target=post, args=(request({"msg": {"payload": i}, "node_id": "n1"}),)) for i in range(16)]
+    for c in clients:
+        c.start()
+    for c in clients:
+        c.join()
+    assert batches == [16]
+
+    # the Node-RED node sends the calls of a batch in one JSON-RPC batch
+    assert server_batch.request_batch_size(pynodered.core.package_options) == 16
+    responses = post([request({"msg": {"payload": i}, "node_id": "n1"}) for i in range(16)])
+    assert [r["result"]["payload"] for r in responses] == list(range(16))
+    assert batches == [16, 16]
+    assert time.perf_counter() - t0 < 2
+
+
+def test_profile(client):
+    assert client.post("/profile/server_batch").status_code == 409  # the calls of a batch function are not profiled
+    assert client.post("/profile/server_echo").status_code == 200
+    client.delete("/profile/server_echo")
+
+
+@pynodered.node_red(name="server_cached", cache=dict(), executor="process")
+def server_cached(node, msg):
+    return msg
+
+
+def test_metrics_process_nodes():
+    # the cache of a node run in worker processes is in the workers, the one of the server process is never used
+    lines = list(metrics.node_collector([server_cached], {})())
+    assert any(line.startswith('pynodered_cache_hits_total{node="server_cached"}') for line in lines)
+    lines = list(metrics.node_collector([server_cached], {}, {"server_cached"})())
+    assert not any('node="server_cached"' in line for line in lines)
+
+
+RELOADED_MODULE = """
+from pynodered import node_red, NodeProperty
+
+@node_red(properties=dict(suffix=NodeProperty("Suffix", value="")))
+def reloaded(node, msg):
+    msg['payload'] = "%s" + node.suffix.value
+    return msg
+"""
+
+
+def test_reload(tmp_path):
+    path = tmp_path / "reloaded_module.py"
+
+    def write(text):
+        t = path.stat().st_mtime + 1 if path.exists() else time.time()
+        path.write_text(text)
+        os.utime(path, (t, t))  # a new modification time even within the resolution of the file system
+
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    url = "http://127.0.0.1:%i/" % port
+
+    def call(**params):
+        data = json.dumps({"jsonrpc": "2.0", "method": "reloaded", "params": params, "id": "1"}).encode()
+        request = urllib.request.Request(url, data, {"Content-Type": "application/json"})
+        return json.loads(urllib.request.urlopen(request, timeout=5).read())
+
+    def wait_for(check):
+        deadline = time.time() + 10
+        while True:
+            try:
+                if check():
+                    return
+            except (OSError, KeyError):  # the server has not started or reloaded yet
+                pass
+            assert time.time() < deadline
+            time.sleep(0.1)
+
+    write(RELOADED_MODULE % "v1")
+    env = dict(os.environ, HOME=str(tmp_path), PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    server_process = subprocess.Popen([sys.executable, "-m", "pynodered.server", "--noinstall", "--server", "flask", "--port", str(port),
+                                       "--watch", "0.1", str(path)], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        config = {"id": "n1", "suffix": ""}
+        wait_for(lambda: call(msg={"payload": None}, node_id="n1", etag="e1", config=config)["result"]["payload"] == "v1")
+
+        # the changed module replaces the node, which gets the configuration of the Node-RED node again
+        write(RELOADED_MODULE % "v2")
+        wait_for(lambda: call(msg={"payload": None}, node_id="n1", etag="e1")["error"]["code"] == server.UNKNOWN_NODE_CONFIG)
+        assert call(msg={"payload": None}, node_id="n1", etag="e2", config=dict(config, suffix="!"))["result"]["payload"] == "v2!"
+        assert call(msg={"payload": None}, node_id="n1", etag="e2")["result"]["payload"] == "v2!"
+
+        # a syntax error keeps the former node
+        write("def reloaded(:\n")
+        time.sleep(0.5)
+        assert call(msg={"payload": None}, node_id="n1", etag="e2")["result"]["payload"] == "v2!"
+        write(RELOADED_MODULE % "v3")
+        wait_for(lambda: call(msg={"payload": None}, node_id="n1", etag="e3", config=config)["result"]["payload"] == "v3")
+    finally:
+        server_process.terminate()
+        server_process.wait()
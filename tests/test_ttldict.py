@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Tests for `pynodered.ttldict`."""
+
+import time
+
+from pynodered.ttldict import TTLDict
+
+
+def test_items_values():
+    d = TTLDict(10, a=1, b=2)
+    assert sorted(d.items()) == [('a', 1), ('b', 2)]
+    assert sorted(d.values()) == [1, 2]
+    assert 'a' in d and 'c' not in d
+
+
+def test_expire():
+    expired = []
+    d = TTLDict(10, on_expire=lambda k, v: expired.append(k))
+    for i in range(5):
+        d[i] = i
+    now = time.time()
+    d.expire_at(1, now - 1)
+    d.expire_at(3, now - 1)
+    d[3] = 3  # set again, no longer expired
+    assert 1 not in d
+    assert d.get(1) is None
+    assert len(d) == 4
+    assert expired == [1]
+
+
+def test_popitem_oldest():
+    d = TTLDict(None)
+    for i in range(3):
+        d[i] = i
+    del d[0]
+    d[0] = 0
+    assert d.popitem(last=False) == (1, 1)
+
+
+def test_reaper():
+    d = TTLDict(0.01, reaper_interval=0.01)
+    d['a'] = 1
+    time.sleep(0.1)
+    d.stop_reaper()
+    assert d._data == {}
+
+
+def test_maxsize():
+    d = TTLDict(None, maxsize=2)
+    d['a'] = 1
+    d['b'] = 2
+    d.move_to_end('a')
+    d['c'] = 3
+    assert sorted(d.keys()) == ['a', 'c']
+
+
+def test_concurrent_move_to_end():
+    # the key is never missing for the readers while it is moved to the end
+    import threading
+    d = TTLDict(None, maxsize=10)
+    d['a'] = 1
+    d['b'] = 2
+    missing = []
+
+    def use():
+        for i in range(20000):
+            if d.get('a') is None:
+                missing.append(i)
+            d.move_to_end('a')
+
+    threads = [threading.Thread(target=use) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert missing == []